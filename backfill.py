@@ -0,0 +1,235 @@
+"""
+Re-send notifications for leads submitted in a date range, e.g. after an outage or when
+onboarding a new recipient.
+
+  python main.py backfill --since 2025-10-16 --until 2025-10-18 --to 123456789
+  python main.py backfill --since 2025-10-16 --to -100987654 --dry-run
+
+The sheet is read in windows (low-priority quota). The leads of a window are rendered like
+live notifications (enrichment, priority) and sent most urgent first, BACKFILL_CONCURRENCY
+at a time, as fast as Telegram's limits allow. Progress is checkpointed after every lead, so
+an interrupted backfill resumes where it stopped. Leads that did not reach every chat stay in
+the checkpoint too, and running the same command again retries them for the chats they missed.
+"""
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from lead_schema import SUBMISSION_DATE_COLUMN, RENDERED_LAST_COLUMN, parse_submission_date
+from config import (
+    BACKFILL_WINDOW_ROWS, BACKFILL_CHECKPOINT_FILE, BACKFILL_CONCURRENCY, TELEGRAM_CHAT_RATE_PER_SECOND,
+    TELEGRAM_GROUP_RATE_PER_SECOND, TELEGRAM_GLOBAL_RATE_PER_SECOND
+)
+
+
+def parse_date_argument(value, end_of_day=False):
+    """Parse YYYY-MM-DD or 'YYYY-MM-DD HH:MM'; a bare --until date covers the whole day"""
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        if date_format == "%Y-%m-%d" and end_of_day:
+            parsed += timedelta(days=1) - timedelta(seconds=1)
+        return parsed
+    raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD or 'YYYY-MM-DD HH:MM'")
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def chat_rate(chat_id):
+    """Telegram allows ~1 msg/s to a private chat and 20 msgs/min to a group (negative IDs)"""
+    return TELEGRAM_GROUP_RATE_PER_SECOND if chat_id < 0 else TELEGRAM_CHAT_RATE_PER_SECOND
+
+
+class Backfill:
+    """Windowed, rate-limited, resumable re-notification of a date range"""
+
+    def __init__(self, monitor, since, until, chat_ids, window_rows=BACKFILL_WINDOW_ROWS,
+                 checkpoint_file=BACKFILL_CHECKPOINT_FILE, concurrency=BACKFILL_CONCURRENCY):
+        if since > until:
+            raise ValueError(f"--since ({since}) is after --until ({until})")
+        self.monitor = monitor
+        self.since = since
+        self.until = until
+        self.chat_ids = list(chat_ids)
+        self.window_rows = window_rows
+        self.checkpoint_file = checkpoint_file
+        self.global_limiter = RateLimiter(TELEGRAM_GLOBAL_RATE_PER_SECOND, burst=TELEGRAM_GLOBAL_RATE_PER_SECOND)
+        self.chat_limiters = {chat_id: RateLimiter(chat_rate(chat_id)) for chat_id in self.chat_ids}
+        self.concurrency = max(1, concurrency)
+        self.next_row = 2  # Skip header row; the first row of the window in progress
+        self.done_rows = set()  # Rows from there on already sent to every chat
+        self.missing = {}  # Row -> chats it could not be delivered to
+        self.sent = 0
+
+    def _job_key(self):
+        return {
+            'sheet_id': self.monitor.sheet_id,
+            'sheet_tab': self.monitor.sheet_tab,
+            'since': self.since.isoformat(),
+            'until': self.until.isoformat(),
+            'chat_ids': sorted(self.chat_ids),
+        }
+
+    def load_checkpoint(self):
+        """Resume a previous run of the same backfill, if there is one"""
+        if not os.path.exists(self.checkpoint_file):
+            return False
+        with open(self.checkpoint_file) as checkpoint:
+            state = json.load(checkpoint)
+        if state.get('job') != self._job_key():
+            print("Checkpoint belongs to a different backfill, starting from the top")
+            return False
+        self.next_row = state['next_row']
+        self.done_rows = set(state.get('done_rows', ()))
+        self.missing = {int(row): chat_ids for row, chat_ids in state.get('missing', {}).items()}
+        self.sent = state['sent']
+        print(f"Resuming backfill at row {self.next_row} ({self.sent} leads already sent)")
+        return True
+
+    def save_checkpoint(self):
+        tmp_path = self.checkpoint_file + '.tmp'
+        with open(tmp_path, 'w') as checkpoint:
+            json.dump({
+                'job': self._job_key(), 'next_row': self.next_row, 'done_rows': sorted(self.done_rows),
+                'missing': {str(row): chat_ids for row, chat_ids in self.missing.items()}, 'sent': self.sent
+            }, checkpoint)
+        os.replace(tmp_path, self.checkpoint_file)
+
+    def clear_checkpoint(self):
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    def in_range(self, row):
+        if len(row) <= SUBMISSION_DATE_COLUMN:
+            return False
+        try:
+            submitted = parse_submission_date(row[SUBMISSION_DATE_COLUMN])
+        except ValueError:
+            return False
+        return self.since <= submitted <= self.until
+
+    async def iter_windows(self):
+        """Yield (next window's first row, [(row_number, row), ...] leads in the date range) per window"""
+        monitor = self.monitor
+        last_row = await asyncio.to_thread(
+            monitor.sheets_service.get_last_row_count, monitor.sheet_id, monitor.sheet_tab
+        )
+        windows = monitor.sheets_service.iter_sheet_windows(
+            monitor.sheet_id, monitor.sheet_tab, self.window_rows,
+            start_row=self.next_row, end_row=last_row, last_column=RENDERED_LAST_COLUMN
+        )
+        while True:
+            # Each window is a blocking (and possibly quota-deferred) read
+            window = await asyncio.to_thread(next, windows, None)
+            if window is None:
+                return
+            first_row, rows = window
+            yield min(first_row + self.window_rows, last_row + 1), [
+                (first_row + offset, row) for offset, row in enumerate(rows) if self.in_range(row)
+            ]
+
+    async def _send(self, chat_id, message):
+        await self.chat_limiters[chat_id].acquire()
+        await self.global_limiter.acquire()
+        return await self.monitor.telegram_service.send_notification(chat_id, message)
+
+    def estimated_seconds(self, lead_count):
+        """Time to deliver lead_count messages to every chat at the configured limits"""
+        if not lead_count or not self.chat_ids:
+            return 0
+        slowest_chat = min(chat_rate(chat_id) for chat_id in self.chat_ids)
+        global_rate = TELEGRAM_GLOBAL_RATE_PER_SECOND
+        return max(lead_count / slowest_chat, lead_count * len(self.chat_ids) / global_rate)
+
+    async def dry_run(self):
+        self.load_checkpoint()
+        started = time.perf_counter()
+        matches = 0
+        async for _, leads in self.iter_windows():
+            matches += len(leads)
+        read_seconds = time.perf_counter() - started
+        send_seconds = self.estimated_seconds(matches)
+
+        print(f"Dry run: {matches} leads between {self.since} and {self.until} "
+              f"would be sent to {len(self.chat_ids)} chat(s)")
+        print(f"Reading the sheet took {read_seconds:.1f}s, sending would take about "
+              f"{timedelta(seconds=round(send_seconds))} at the current rate limits")
+        return matches
+
+    async def run(self):
+        """Send every lead in the range, checkpointing after each one"""
+        # Backfill targets are given on the command line, so they are authorized explicitly
+        self.monitor.telegram_service.routed_chats = set(self.monitor.telegram_service.routed_chats) | set(self.chat_ids)
+        self.load_checkpoint()
+        await self.monitor.refresh_campaigns()
+        started = time.perf_counter()
+        sent_before = self.sent
+        slots = asyncio.Semaphore(self.concurrency)
+
+        try:
+            async for next_window_row, leads in self.iter_windows():
+                leads = [
+                    self.monitor.render_lead({'row': row, 'row_number': row_number, 'lead_number': self.sent + i + 1})
+                    for i, (row_number, row) in enumerate(
+                        (row_number, row) for row_number, row in leads if row_number not in self.done_rows
+                    )
+                ]
+                # Most urgent first; sorted() keeps sheet order within a priority
+                leads = sorted((lead for lead in leads if lead['message']), key=lambda lead: lead['priority'])
+                await asyncio.gather(*(self._deliver(lead, slots) for lead in leads))
+                # A rerun has to read the window of the first undelivered lead again
+                if not self.missing:
+                    self.next_row = next_window_row
+                    self.done_rows = set()
+                self.save_checkpoint()
+        finally:
+            # Sheets or Telegram failing mid-run: keep what was sent so a rerun resumes here
+            self.save_checkpoint()
+
+        elapsed = time.perf_counter() - started
+        delivered = self.sent - sent_before
+        if self.missing:
+            print(f"⚠️  Backfill finished: {delivered} leads sent in {elapsed:.1f}s, {len(self.missing)} "
+                  f"could not be delivered to every chat; run the same command again to retry them")
+            return
+        print(f"✅ Backfill complete: {delivered} leads sent in {elapsed:.1f}s "
+              f"({delivered / max(elapsed, 1e-9):.2f} leads/s)")
+        self.clear_checkpoint()
+
+    async def _deliver(self, lead, slots):
+        row_number = lead['row_number']
+        chat_ids = self.missing.get(row_number, self.chat_ids)  # Only the chats a previous run missed
+        async with slots:
+            results = await asyncio.gather(*(self._send(chat_id, lead['message']) for chat_id in chat_ids))
+        missing = [chat_id for chat_id, ok in zip(chat_ids, results) if not ok]
+        if missing:
+            self.missing[row_number] = missing
+        else:
+            self.missing.pop(row_number, None)
+            self.done_rows.add(row_number)
+            self.sent += 1
+        self.save_checkpoint()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the code that runs once per sheet row, with a regression gate.
+
+Measures get_lead_id, is_new_lead, format_single_lead_notification, the dedup check
+(fingerprint + set membership against a set of `size` processed leads), the repeat-lead
+check (normalized email and phone against the contact index) and one end-to-end
+check_for_new_leads() cycle against the in-memory fakes. Results are nanoseconds per row
+(per new lead for the cycle), best of --repeat runs.
+
+Usage:
+  python benchmarks/bench_hot_paths.py                      # compare with baseline.json
+  python benchmarks/bench_hot_paths.py --save-baseline      # record a new baseline
+  python benchmarks/bench_hot_paths.py --sizes 1000 --max-regression 10
+
+Exits with status 1 when any result is more than --max-regression percent slower than the
+baseline. Baselines are only comparable on the machine that recorded them.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+os.environ['SNAPSHOT_ENABLED'] = 'false'
+os.environ['SEND_DELAY_SECONDS'] = '0'
+os.environ['QUOTA_ENABLED'] = 'false'
+os.environ['ROUTING_RULES_FILE'] = ''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeSheetsApi, FakeTelegramService, SyntheticRows
+from google_sheets_service import GoogleSheetsService
+from leads_monitor import LeadsMonitor
+from lead_fingerprints import contact_fingerprints
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+LEAD_OFFSET = 5000  # Lead 5000 onwards is submitted after the October 16 cutoff, like live leads
+ROW_POOL = 20000  # Distinct rows cycled through; per-row cost doesn't depend on the sheet size
+CYCLE_NEW_ROWS = 100
+MIN_TOTAL_SECONDS = 0.5  # Small sizes are repeated until they ran at least this long
+RECHECKS = 2  # Times a regressed benchmark is measured again before failing
+
+
+def best_of(repeat, run):
+    """Smallest wall time of at least repeat calls to run()"""
+    timings = []
+    while len(timings) < repeat or sum(timings) < MIN_TOTAL_SECONDS:
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def make_monitor(rows):
+    return LeadsMonitor(
+        sheets_service=GoogleSheetsService(service=FakeSheetsApi(rows)),
+        telegram_service=FakeTelegramService(),
+    )
+
+
+def row_benchmarks(size, repeat):
+    """name -> callable measuring ns/row of each per-row function over size rows"""
+    pool = SyntheticRows(min(size, ROW_POOL), offset=LEAD_OFFSET)[1:]
+    monitor = make_monitor(SyntheticRows(0))
+    # The membership check only depends on the set's size, not on which leads are in it
+    monitor.processed_leads = {random.getrandbits(64) for _ in range(size)}
+    processed = monitor.processed_leads
+    contacts = {random.getrandbits(64) for _ in range(2 * size)}
+
+    def over_rows(func):
+        def run():
+            for row in itertools.islice(itertools.cycle(pool), size):
+                func(row)
+        return run
+
+    cases = {
+        'get_lead_id': over_rows(monitor.get_lead_id),
+        'is_new_lead': over_rows(monitor.is_new_lead),
+        'format_single_lead_notification': over_rows(
+            lambda row: monitor.format_single_lead_notification(row, 1, total_rows=size)
+        ),
+        'dedup_check': over_rows(lambda row: monitor.get_lead_fingerprint(row) in processed),
+        'repeat_check': over_rows(
+            lambda row: [contact in contacts for _, contact in contact_fingerprints(row)]
+        ),
+    }
+    return {
+        f'{name}[{size}]': (lambda run=run: best_of(repeat, run) / size * 1e9)
+        for name, run in cases.items()
+    }
+
+
+def bench_cycle(size, repeat):
+    """ns per new lead for one poll -> send cycle on a sheet that already has size leads"""
+    rows = SyntheticRows(size, offset=LEAD_OFFSET)
+    monitor = make_monitor(rows)
+    monitor.last_row_count = len(rows)
+    monitor.processed_leads = {random.getrandbits(64) for _ in range(size)}
+    monitor.contact_index = {random.getrandbits(64) for _ in range(2 * size)}
+    monitor.initialized = True
+
+    async def cycles():
+        timings = []
+        while len(timings) < repeat or sum(timings) < MIN_TOTAL_SECONDS:
+            rows.count += CYCLE_NEW_ROWS
+            started = time.perf_counter()
+            await monitor.check_for_new_leads()
+            timings.append(time.perf_counter() - started)
+        await monitor.pipeline.stop()
+        return min(timings), len(timings)
+
+    # Silence the per-lead log lines, they would dominate the measurement
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        elapsed, cycle_count = asyncio.run(cycles())
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    sent = len(monitor.telegram_service.sent)
+    if sent != cycle_count * CYCLE_NEW_ROWS:
+        raise RuntimeError(f"Expected {cycle_count * CYCLE_NEW_ROWS} notifications, got {sent}")
+    return elapsed / CYCLE_NEW_ROWS * 1e9
+
+
+def collect_benchmarks(sizes, repeat):
+    """name -> callable returning the benchmark's ns/row"""
+    benchmarks = {}
+    for size in sizes:
+        benchmarks.update(row_benchmarks(size, repeat))
+        benchmarks[f'check_for_new_leads[{size}]'] = lambda size=size: bench_cycle(size, repeat)
+    return benchmarks
+
+
+def change_percent(value, base):
+    return (value - base) / base * 100
+
+
+def regressions(results, baseline, max_regression):
+    """Names of the results more than max_regression percent slower than the baseline"""
+    return [
+        name for name, value in results.items()
+        if name in baseline and change_percent(value, baseline[name]) > max_regression
+    ]
+
+
+def print_table(results, baseline, max_regression):
+    print(f"{'benchmark':<46} {'ns/row':>10} {'baseline':>10} {'change':>8}")
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<46} {value:>10.0f} {'-':>10} {'-':>8}")
+            continue
+        change = change_percent(value, base)
+        flag = '  REGRESSION' if change > max_regression else ''
+        print(f"{name:<46} {value:>10.0f} {base:>10.0f} {change:>+7.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-row hot paths")
+    parser.add_argument('--sizes', default='1000,100000,1000000', help="Comma-separated sheet sizes in rows")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per benchmark, the fastest counts")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="Write the results as the new baseline")
+    parser.add_argument('--max-regression', type=float, default=float(os.getenv('BENCH_MAX_REGRESSION', '20')),
+                        help="Fail when a result is this many percent slower than the baseline")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    benchmarks = collect_benchmarks(sizes, args.repeat)
+    results = {name: measure() for name, measure in benchmarks.items()}
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'processor': platform.processor(),
+                'results': {name: round(value, 1) for name, value in results.items()},
+            }, baseline_file, indent=2)
+            baseline_file.write('\n')
+        print_table(results, {}, args.max_regression)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    else:
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+
+    regressed = regressions(results, baseline, args.max_regression)
+    for _ in range(RECHECKS):
+        if not regressed:
+            break
+        # A busy or throttled CPU easily adds 20% to one run, so a slowdown has to repeat to count
+        print(f"Re-measuring {len(regressed)} slower benchmark(s)...")
+        for name in regressed:
+            results[name] = min(results[name], benchmarks[name]())
+        regressed = regressions(results, baseline, args.max_regression)
+
+    print_table(results, baseline, args.max_regression)
+    if regressed:
+        print(f"{len(regressed)} benchmark(s) regressed by more than {args.max_regression:.0f}%: "
+              f"{', '.join(regressed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark LeadsMonitor.initialize() against a synthetic sheet for several window sizes.
+
+Each window size runs in its own subprocess so peak RSS is measured independently.
+
+Usage:
+  python benchmarks/bench_initial_load.py --rows 200000 --windows 1000,5000,20000,full
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_single(rows, window, prefetch):
+    """Run one initialization in this process and print 'rows_per_sec peak_rss_mb'"""
+    os.environ['INITIAL_LOAD_WINDOW_ROWS'] = str(window)
+    os.environ['INITIAL_LOAD_PREFETCH'] = str(prefetch)
+    os.environ['SNAPSHOT_ENABLED'] = 'false'
+    sys.path.insert(0, REPO_ROOT)
+
+    from benchmarks.fakes import FakeSheetsApi, FakeTelegramService, SyntheticRows
+    from google_sheets_service import GoogleSheetsService
+    from leads_monitor import LeadsMonitor
+
+    monitor = LeadsMonitor(
+        sheets_service=GoogleSheetsService(service=FakeSheetsApi(SyntheticRows(rows))),
+        telegram_service=FakeTelegramService(),
+    )
+    started = time.perf_counter()
+    asyncio.run(monitor.initialize())
+    elapsed = time.perf_counter() - started
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"RESULT {rows / elapsed:.0f} {peak_rss_mb:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming initial load")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--windows', default='1000,5000,20000,full',
+                        help="Comma-separated window sizes, 'full' reads the sheet in one request")
+    parser.add_argument('--prefetch', type=int, default=1)
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        run_single(args.rows, args.single, args.prefetch)
+        return
+
+    print(f"{'window':>10} {'rows/sec':>12} {'peak RSS (MB)':>14}")
+    for window in args.windows.split(','):
+        size = args.rows + 1 if window == 'full' else int(window)
+        output = subprocess.run(
+            [sys.executable, __file__, '--rows', str(args.rows), '--prefetch', str(args.prefetch),
+             '--single', str(size)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = [line for line in output.splitlines() if line.startswith('RESULT ')][-1]
+        rows_per_sec, peak_rss = result.split()[1:]
+        print(f"{window:>10} {rows_per_sec:>12} {peak_rss:>14}")
+
+
+if __name__ == "__main__":
+    main()
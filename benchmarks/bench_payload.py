@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Compare response sizes per Sheets call type, before and after request shaping.
+
+"legacy" issues the requests exactly as the bot used to (full A:A for the row count,
+A:Z for the data, no field mask); "shaped" goes through GoogleSheetsService.
+
+Usage:
+  python benchmarks/bench_payload.py --rows 20000 --new-rows 5
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeSheetsApi, SyntheticRows
+from google_sheets_service import GoogleSheetsService
+from lead_schema import RENDERED_LAST_COLUMN
+
+SHEET_ID = 'bench-sheet'
+TAB = 'facebook'
+
+
+def measure(api, call):
+    """Run call against api and return (raw bytes, gzip bytes, requests)"""
+    api.bytes_received = api.gzip_bytes_received = 0
+    api.calls.clear()
+    call()
+    return api.bytes_received, api.gzip_bytes_received, len(api.calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Sheets response payload sizes")
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--new-rows', type=int, default=5)
+    args = parser.parse_args()
+
+    api = FakeSheetsApi(SyntheticRows(args.rows))
+    service = GoogleSheetsService(service=api)
+    values = api.spreadsheets().values()
+    known = len(api.rows) - args.new_rows
+    current = len(api.rows)
+
+    cases = [
+        ("row count", "legacy",
+         lambda: values.get(spreadsheetId=SHEET_ID, range=f'{TAB}!A:A').execute()),
+        ("row count", "shaped",
+         lambda: service.get_last_row_count(SHEET_ID, TAB, known_rows=known)),
+        ("new rows", "legacy",
+         lambda: values.get(spreadsheetId=SHEET_ID, range=f'{TAB}!A:Z').execute()),
+        ("new rows", "shaped",
+         lambda: service.get_sheet_data(SHEET_ID, TAB, f'A{known + 1}:{RENDERED_LAST_COLUMN}{current}')),
+        ("full load", "legacy",
+         lambda: values.get(spreadsheetId=SHEET_ID, range=f'{TAB}!A:Z').execute()),
+        ("full load", "shaped",
+         lambda: service.get_sheet_data(SHEET_ID, TAB, f'A1:{RENDERED_LAST_COLUMN}{current}')),
+    ]
+
+    print(f"{args.rows} rows, {args.new_rows} new rows per cycle")
+    print(f"{'call':<12} {'mode':<8} {'requests':>8} {'bytes':>12} {'gzip bytes':>12}")
+    for call_type, mode, call in cases:
+        raw, compressed, requests = measure(api, call)
+        print(f"{call_type:<12} {mode:<8} {requests:>8} {raw:>12} {compressed:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark a full resync (LeadsMonitor.initialize() without a checkpoint) for several
+RESYNC_WORKERS settings, 0 being the in-process serial load.
+
+"snapshot" resyncs from a complete local snapshot (cursor loss), "api" from an empty one
+(first boot), where every row is downloaded from the fake Sheets API first. Each run is
+a separate subprocess.
+
+Usage:
+  python benchmarks/bench_resync.py --rows 500000 --workers 0,1,2,4,8
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_single(rows, workers, snapshot_dir):
+    """Run one initialization in this process and print 'seconds'"""
+    os.environ['RESYNC_WORKERS'] = str(workers)
+    os.environ['RESYNC_PARALLEL_MIN_ROWS'] = '1'
+    os.environ['SNAPSHOT_DIR'] = snapshot_dir
+    os.environ['STATE_FILE'] = os.path.join(snapshot_dir, 'no-checkpoint.json')
+    sys.path.insert(0, REPO_ROOT)
+
+    from benchmarks.fakes import FakeSheetsApi, FakeTelegramService, SyntheticRows
+    from google_sheets_service import GoogleSheetsService
+    from leads_monitor import LeadsMonitor
+
+    monitor = LeadsMonitor(
+        sheets_service=GoogleSheetsService(service=FakeSheetsApi(SyntheticRows(rows))),
+        telegram_service=FakeTelegramService(),
+    )
+    started = time.perf_counter()
+    asyncio.run(monitor.initialize())
+    elapsed = time.perf_counter() - started
+    if len(monitor.processed_leads) != rows:
+        raise RuntimeError(f"Expected {rows} fingerprints, got {len(monitor.processed_leads)}")
+    print(f"RESULT {elapsed:.3f}")
+
+
+def measure(rows, workers, snapshot_dir):
+    output = subprocess.run(
+        [sys.executable, __file__, '--rows', str(rows), '--single', str(workers), '--snapshot-dir', snapshot_dir],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return float([line for line in output.splitlines() if line.startswith('RESULT ')][-1].split()[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parallel resync")
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--workers', default='0,1,2,4,8', help="Comma-separated RESYNC_WORKERS values")
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--snapshot-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        run_single(args.rows, args.single, args.snapshot_dir)
+        return
+
+    print(f"{os.cpu_count()} CPU(s), {args.rows} rows")
+    print(f"{'source':>9} {'workers':>8} {'seconds':>9} {'rows/sec':>10} {'speedup':>8}")
+    work_dir = tempfile.mkdtemp(prefix='bench-resync-')
+    try:
+        snapshot_dir = os.path.join(work_dir, 'snapshot')
+        for source in ('api', 'snapshot'):
+            serial = None
+            for workers in (int(value) for value in args.workers.split(',')):
+                if source == 'api':
+                    shutil.rmtree(snapshot_dir, ignore_errors=True)
+                elif not os.path.exists(snapshot_dir):
+                    measure(args.rows, 0, snapshot_dir)  # Build the snapshot once
+                seconds = measure(args.rows, workers, snapshot_dir)
+                serial = serial or seconds
+                print(f"{source:>9} {workers:>8} {seconds:>9.2f} {args.rows / seconds:>10.0f} "
+                      f"{serial / seconds:>7.2f}x")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+In-memory stand-ins for the Google Sheets and Telegram APIs, used by the benchmarks.
+
+FakeSheetsApi mimics the `service.spreadsheets().values()` resource returned by
+googleapiclient, so the real GoogleSheetsService code runs on top of it.
+"""
+
+import gzip
+import json
+import re
+from datetime import datetime, timedelta
+from circuit_breaker import CircuitBreaker
+
+HEADER = [
+    "Form Type", "Submission Date", "Name", "Email", "Phone", "Platform",
+    "Campaign Name", "Adset Name", "Ad Name", "Underarm Concerns", "Eye Area Concerns",
+    "Duration of Concern", "Preferred Appointment Time", "Contact Preference", "Status",
+]
+
+FIRST_NAMES = ["John", "Mei Ling", "Aisha", "Kumar", "Sarah", "Wei Jie", "Nur", "Daniel"]
+LAST_NAMES = ["Tan", "Lim", "Rahman", "Singh", "Wong", "Ng", "Lee", "Goh"]
+CAMPAIGNS = ["Underarm Whitening Oct", "Eye Bag Removal Q4", "Dark Circles Promo"]
+PLATFORMS = ["fb", "ig"]
+START_DATE = datetime(2025, 10, 1, 9, 0, 0)
+
+
+def synthetic_lead(index):
+    """Build a deterministic Facebook lead-form row"""
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    last = LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    campaign = CAMPAIGNS[index % len(CAMPAIGNS)]
+    submitted = START_DATE + timedelta(minutes=7 * index)
+    underarm = campaign.startswith("Underarm")
+    return [
+        "Lead Form - " + campaign,
+        submitted.strftime("%B %d %Y %H:%M:%S"),
+        f"{first} {last}",
+        f"{first.lower().replace(' ', '.')}.{last.lower()}{index}@gmail.com",
+        f"+65 9{index % 1000:03d} {index % 10000:04d}",
+        PLATFORMS[index % len(PLATFORMS)],
+        campaign,
+        f"Adset {index % 12}",
+        f"Ad {index % 40}",
+        "Darkening, odour" if underarm else "",
+        "" if underarm else "Eye bags, dark circles",
+        "More than 1 year",
+        "Weekday evenings",
+        "Call" if index % 3 == 0 else "WhatsApp",
+        "New",
+    ]
+
+
+class SyntheticRows:
+    """Lazily generated sheet rows (header + count leads), so large fixtures cost no memory"""
+
+    def __init__(self, count, offset=0):
+        self.count = count
+        self.offset = offset
+
+    def __len__(self):
+        return self.count + 1
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[index] for index in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        return list(HEADER) if item == 0 else synthetic_lead(self.offset + item - 1)
+
+
+def synthetic_sheet(count):
+    """Return a materialized sheet with a header and count synthetic leads"""
+    return SyntheticRows(count)[:]
+
+
+_RANGE_PATTERN = re.compile(r"^(?:[^!]*!)?([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$")
+
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def parse_range(range_str, row_count):
+    """Parse an A1 range into zero-based (first_row, last_row, first_col, last_col), inclusive"""
+    match = _RANGE_PATTERN.match(range_str)
+    if not match:
+        raise ValueError(f"Unsupported range '{range_str}'")
+    first_col, first_row, last_col, last_row = match.groups()
+    last_col = last_col or first_col
+    first_row = int(first_row) - 1 if first_row else 0
+    last_row = int(last_row) - 1 if last_row else row_count - 1
+    return first_row, min(last_row, row_count - 1), _column_index(first_col), _column_index(last_col)
+
+
+class FakeRequest:
+    """Mimics googleapiclient.http.HttpRequest"""
+
+    def __init__(self, api, method, params, handler):
+        self.api = api
+        self.method = method
+        self.params = params
+        self.headers = {}
+        self._handler = handler
+
+    def execute(self):
+        self.api.calls.append(self)
+        response = self._handler()
+        if self.params.get('fields'):
+            # Only top-level field masks are supported, which is all the bot uses
+            kept = {field.strip() for field in self.params['fields'].split(',')}
+            response = {key: value for key, value in response.items() if key in kept}
+        # Round-trip through JSON so decode cost and memory match the real client
+        body = json.dumps(response).encode('utf-8')
+        self.api.bytes_received += len(body)
+        self.api.gzip_bytes_received += len(gzip.compress(body))
+        return json.loads(body)
+
+
+class FakeSheetsApi:
+    """Serves `spreadsheets().values().get` and `.batchUpdate` from an in-memory list of rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.written = {}  # Zero-based row -> {column: value} set by batchUpdate, laid over rows
+        self.calls = []
+        self.bytes_received = 0
+        self.gzip_bytes_received = 0
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range, **params):
+        return FakeRequest(self, 'values.get', dict(params, range=range),
+                           lambda: self._values_get(range, params))
+
+    def batchUpdate(self, spreadsheetId, body, **params):
+        return FakeRequest(self, 'values.batchUpdate', dict(params, body=body),
+                           lambda: self._values_batch_update(spreadsheetId, body))
+
+    def _row(self, index):
+        row = self.rows[index]
+        if index in self.written:
+            row = list(row)
+            for col, value in self.written[index].items():
+                row.extend([""] * (col + 1 - len(row)))
+                row[col] = value
+        return row
+
+    def _values_get(self, range_str, params):
+        first_row, last_row, first_col, last_col = parse_range(range_str.split('!')[-1], len(self.rows))
+        values = []
+        for index in range(first_row, last_row + 1):
+            values.append(list(self._row(index)[first_col:last_col + 1]))
+        # The API trims trailing empty rows
+        while values and not any(values[-1]):
+            values.pop()
+        if params.get('majorDimension') == 'COLUMNS':
+            width = max((len(row) for row in values), default=0)
+            values = [[row[col] if col < len(row) else "" for row in values] for col in range(width)]
+        response = {'range': range_str, 'majorDimension': params.get('majorDimension', 'ROWS')}
+        if values:
+            response['values'] = values
+        return response
+
+    def _values_batch_update(self, spreadsheet_id, body):
+        updated = 0
+        for data in body['data']:
+            first_row, _, first_col, _ = parse_range(data['range'].split('!')[-1], len(self.rows))
+            values = data['values']
+            if data.get('majorDimension') == 'COLUMNS':
+                values = [list(row) for row in zip(*values)]
+            for row_offset, row in enumerate(values):
+                for col_offset, value in enumerate(row):
+                    self.written.setdefault(first_row + row_offset, {})[first_col + col_offset] = value
+                    updated += 1
+        return {'spreadsheetId': spreadsheet_id, 'totalUpdatedCells': updated}
+
+
+class FakeTelegramService:
+    """Records notifications instead of sending them"""
+
+    def __init__(self, allowed_users=(1,)):
+        self.allowed_users = list(allowed_users)
+        self.routed_chats = set()
+        self.sent = []
+        self.breaker = CircuitBreaker('Telegram')
+
+    async def send_notification(self, user_id, message):
+        self.sent.append((user_id, message))
+        return True
+
+    async def send_notifications_to_all(self, message):
+        return await self.send_notifications_to(self.allowed_users, message)
+
+    async def send_notifications_to(self, user_ids, message):
+        for user_id in user_ids:
+            await self.send_notification(user_id, message)
+        return bool(user_ids)
+
+    async def get_bot_info(self):
+        return None
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Replay a captured trace (TRACE_CAPTURE_FILE, see traffic_trace.py) through LeadsMonitor offline.
+
+The monitor starts at the row count the captured bot started with and polls whenever the
+captured bot polled. Every Sheets and Telegram request is answered from the trace after
+its recorded latency divided by --speed (0: no latency and polls back to back), and
+SEND_DELAY_SECONDS is scaled the same way. The initial sheet load is not replayed,
+bench_resync.py covers it. Run with the captured bot's settings (routing rules, allowed
+users), and on two versions to compare them on the same day of traffic.
+
+Usage:
+  python benchmarks/replay_trace.py traces/capture.jsonl                 # real time
+  python benchmarks/replay_trace.py traces/capture.jsonl --speed 60      # a day in 24 minutes
+  python benchmarks/replay_trace.py traces/capture.jsonl --speed 0 --json result.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure(speed, work_dir):
+    """Environment for the replay; must run before the bot's modules read config.py"""
+    os.environ['TRACE_CAPTURE_FILE'] = ''
+    os.environ['SNAPSHOT_ENABLED'] = 'false'
+    os.environ['QUOTA_ENABLED'] = 'false'  # The quota state file is shared with a live bot
+    os.environ['STATE_FILE'] = os.path.join(work_dir, 'monitor_state.json')
+    send_delay = float(os.getenv('SEND_DELAY_SECONDS', '1'))
+    os.environ['SEND_DELAY_SECONDS'] = str(send_delay / speed if speed else 0)
+    sys.path.insert(0, REPO_ROOT)
+
+
+def replay(trace_path, speed, sheet_id=None, verbose=False):
+    from traffic_trace import Trace, ReplaySheetsApi, ReplayBot, ReplayTimings
+    from google_sheets_service import GoogleSheetsService
+    from telegram_service import TelegramService
+    from leads_monitor import LeadsMonitor
+
+    trace = Trace(trace_path)
+    starts = [event for event in trace.events if event['event'] == 'initialized'
+              and (sheet_id is None or event['sheet_id'] == sheet_id)]
+    if not starts:
+        raise SystemExit(f"No initialized monitor{' for ' + sheet_id if sheet_id else ''} in {trace_path}")
+    start = starts[0]
+    polls = [event for event in trace.events if event['event'] == 'poll' and event['t'] >= start['t']
+             and (event['sheet_id'], event['sheet_tab']) == (start['sheet_id'], start['sheet_tab'])]
+    trace.skip_until(start['t'])
+
+    timings = ReplayTimings()
+    sheets_api = ReplaySheetsApi(trace, speed, timings)
+    tenant = {'sheet_id': start['sheet_id'], 'sheet_tab': start['sheet_tab'], 'writeback': False}
+    writes = [call for call in trace.calls if call['call'] == 'values.batchUpdate'
+              and call['args']['spreadsheetId'] == start['sheet_id']]
+    if writes:
+        ranges = writes[0]['args']['body']['data']
+        tenant.update(writeback=True, writeback_column=re.match(r".*!([A-Z]+)", ranges[0]['range']).group(1))
+    telegram_service = TelegramService(token='0:replay')
+    telegram_service.bot = ReplayBot(trace, speed, timings)
+    monitor = LeadsMonitor(
+        sheets_service=GoogleSheetsService(service=sheets_api),
+        telegram_service=telegram_service,
+        tenant=tenant,
+        writeback_service=GoogleSheetsService.for_writes(service=sheets_api) if writes else None,
+    )
+
+    async def run():
+        monitor.last_row_count = start['rows']
+        monitor.initialized = True
+        await monitor.start_pipeline()
+        started = time.monotonic()
+        for poll in polls:
+            if speed:
+                delay = (poll['t'] - start['t']) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await monitor.pipeline.put('poll')
+        await monitor.pipeline.join()
+        elapsed = time.monotonic() - started
+        await monitor.pipeline.stop()
+        return elapsed
+
+    # The per-lead log lines would drown the summary
+    stdout = sys.stdout
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        elapsed = asyncio.run(run())
+    finally:
+        if not verbose:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    metrics = monitor.metrics()
+    return {
+        'trace': trace_path,
+        'sheet': f"{start['sheet_id']}/{start['sheet_tab']}",
+        'speed': speed,
+        'polls': len(polls),
+        'captured_seconds': round(polls[-1]['t'] - start['t'], 3) if polls else 0,
+        'replay_seconds': round(elapsed, 3),
+        'leads_sent': metrics['leads_sent'],
+        'leads_failed': metrics['leads_failed'],
+        'poll_errors': metrics['poll_errors'],
+        'delivery_latency': metrics['delivery_latency'],
+        'calls': timings.summary(),
+        'misses': dict(trace.misses),
+        'unused_responses': trace.unused(),
+    }
+
+
+def print_result(result):
+    print(f"Replayed {result['polls']} polls of {result['sheet']} at speed {result['speed']:g}: "
+          f"{result['replay_seconds']:.2f}s (captured {result['captured_seconds']:.1f}s)")
+    print(f"Leads sent {result['leads_sent']}, failed {result['leads_failed']}, poll errors {result['poll_errors']}")
+    print(f"{'call':<28} {'calls':>7} {'mean ms':>9} {'p95 ms':>9}")
+    for name, stats in result['calls'].items():
+        print(f"{name:<28} {stats['calls']:>7} {stats['mean_ms']:>9.1f} {stats['p95_ms']:>9.1f}")
+    for priority, stats in result['delivery_latency'].items():
+        print(f"Delivery latency {priority}: avg {stats['avg_seconds']:.2f}s, max {stats['max_seconds']:.2f}s "
+              f"({stats['delivered']} leads)")
+    if result['misses']:
+        # Requests the captured bot never made: the code under test behaves differently
+        print(f"Requests without a recorded response: {result['misses']}")
+    if result['unused_responses']:
+        print(f"Recorded responses not requested: {result['unused_responses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured Sheets and Telegram traffic")
+    parser.add_argument('trace', help="JSONL trace written with TRACE_CAPTURE_FILE")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="Speed-up over the captured timing, 0 replays as fast as possible")
+    parser.add_argument('--sheet-id', help="Sheet to replay when the trace has several (multi-tenant)")
+    parser.add_argument('--json', help="Also write the results to this file")
+    parser.add_argument('--verbose', action='store_true', help="Show the monitor's log")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='replay-')
+    try:
+        configure(args.speed, work_dir)
+        result = replay(args.trace, args.speed, args.sheet_id, args.verbose)
+    finally:
+        shutil.rmtree(work_dir)
+    print_result(result)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(result, json_file, indent=2)
+            json_file.write('\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import threading
+import time
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS, CIRCUIT_MAX_RESET_SECONDS
+
+
+class ServiceError(Exception):
+    """A call to an external service (Sheets, Telegram) failed"""
+
+    def __init__(self, service, message):
+        super().__init__(f"{service}: {message}")
+        self.service = service
+
+
+class CircuitOpenError(ServiceError):
+    """The service's circuit is open, so the call was not attempted"""
+
+    def __init__(self, service, retry_after):
+        super().__init__(service, f"circuit open, next probe in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency after repeated failures.
+
+    closed:    calls go through, consecutive failures are counted
+    open:      calls fail fast with CircuitOpenError until the reset timeout passes
+    half_open: a single probe call is let through; success closes the circuit, failure
+               re-opens it with the timeout doubled (up to max_reset_timeout)
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_SECONDS,
+                 max_reset_timeout=CIRCUIT_MAX_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()  # Sheets calls run on worker threads
+
+    def retry_after(self):
+        """Seconds until the next call may be attempted, 0 if calls are allowed now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0
+            if self.state == self.HALF_OPEN:
+                return self.reset_timeout if self._probe_in_flight else 0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def is_open(self):
+        return self.state != self.CLOSED
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may be made now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                raise CircuitOpenError(self.name, self.reset_timeout)
+            self._probe_in_flight = True
+            print(f"{self.name} circuit half-open, probing")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"✅ {self.name} recovered, circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.reset_timeout = self.base_reset_timeout
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                # The probe failed: back off further before the next one
+                self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+                self._open()
+            elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self._probe_in_flight = False
+        print(f"⚠️  {self.name} circuit open after {self.failures} failures, "
+              f"pausing calls for {self.reset_timeout:.0f}s")
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened,
+            'retry_after_seconds': round(self.retry_after(), 1),
+        }
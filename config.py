@@ -1,12 +1,20 @@
 import os
-from dotenv import load_dotenv
+import tempfile
+from dotenv import load_dotenv, dotenv_values
 
 # Load environment variables
-load_dotenv()
+CONFIG_FILE = os.getenv('CONFIG_FILE', '.env')
+_ENVIRONMENT_KEYS = frozenset(os.environ)  # Set before the file is read, so they win over it
+load_dotenv(CONFIG_FILE)
+
+
+def parse_user_ids(value):
+    """Parse a comma-separated list of Telegram user IDs"""
+    return [int(user_id) for user_id in value.split(',') if user_id.strip()]
 
 # Telegram Bot Configuration
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '8456182596:AAG4OBD_MzL6twCmG_uRx_EKQiEr7PT_A3A')
-TELEGRAM_ALLOWED_USERS = [int(user_id) for user_id in os.getenv('TELEGRAM_ALLOWED_USERS', '7027631325').split(',') if user_id.strip()]
+TELEGRAM_ALLOWED_USERS = parse_user_ids(os.getenv('TELEGRAM_ALLOWED_USERS', '7027631325'))
 
 # Google Sheets Configuration
 GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID', '14bxGTo91qif2XRw7nmLpcjliNSSWw3tZXKwyeJir5lM')
@@ -19,6 +27,130 @@ CHECK_INTERVAL_MINUTES = int(os.getenv('CHECK_INTERVAL_MINUTES', '5'))
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
 CREDENTIALS_FILE = 'credentials.json'
 TOKEN_FILE = 'token.json'
+# Broader scope for the optional write-back, granted to a separate token so reads stay read-only
+WRITE_SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+WRITE_TOKEN_FILE = 'token_write.json'
 
 # Environment Detection
 IS_PRODUCTION = os.getenv('RAILWAY_ENVIRONMENT') is not None or os.getenv('PORT') is not None
+
+# Local Snapshot Configuration
+SNAPSHOT_ENABLED = os.getenv('SNAPSHOT_ENABLED', 'true').lower() == 'true'
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'snapshot')
+SNAPSHOT_COLUMNS = 26  # Columns A:Z
+SNAPSHOT_VERIFY_ROWS = int(os.getenv('SNAPSHOT_VERIFY_ROWS', '50'))  # Last rows compared with the sheet on start
+
+# Initial Load Configuration
+INITIAL_LOAD_WINDOW_ROWS = int(os.getenv('INITIAL_LOAD_WINDOW_ROWS', '5000'))
+INITIAL_LOAD_PREFETCH = int(os.getenv('INITIAL_LOAD_PREFETCH', '1'))
+
+# Resync Configuration
+RESYNC_WORKERS = int(os.getenv('RESYNC_WORKERS', str(min(4, os.cpu_count() or 1))))  # 0 fingerprints in-process
+RESYNC_PARALLEL_MIN_ROWS = int(os.getenv('RESYNC_PARALLEL_MIN_ROWS', '50000'))  # Smaller sheets aren't worth the pool
+
+# Repeat Lead Configuration
+REPEAT_LEAD_ACTION = os.getenv('REPEAT_LEAD_ACTION', 'tag').lower()  # tag, suppress or off
+PHONE_DEFAULT_COUNTRY_CODE = os.getenv('PHONE_DEFAULT_COUNTRY_CODE', '65')  # For numbers entered without one
+
+# Write-back Configuration
+WRITEBACK_ENABLED = os.getenv('WRITEBACK_ENABLED', 'false').lower() == 'true'  # Record "Notified at" in the sheet
+WRITEBACK_COLUMN = os.getenv('WRITEBACK_COLUMN', 'P')  # An empty column, right of the lead form's columns
+
+# Sheets Request Configuration
+SHEET_LAST_COLUMN = os.getenv('SHEET_LAST_COLUMN', '')  # Defaults to the last rendered column
+SHEETS_VALUE_RENDER_OPTION = os.getenv('SHEETS_VALUE_RENDER_OPTION', 'FORMATTED_VALUE')
+
+# Pipeline Configuration
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '100'))
+# Workers per stage, e.g. "renderer=2,sender=4" (stages default to 1; poller and deduper always run alone)
+PIPELINE_CONCURRENCY = {
+    name.strip(): int(count)
+    for name, count in (item.split('=') for item in os.getenv('PIPELINE_CONCURRENCY', '').split(',') if '=' in item)
+}
+SEND_DELAY_SECONDS = float(os.getenv('SEND_DELAY_SECONDS', '1'))
+
+# Routing Configuration
+ROUTING_RULES_FILE = os.getenv('ROUTING_RULES_FILE', '')  # JSON rules, see lead_router.py
+# Seconds of waiting worth one priority level, so queued low-priority leads still get their turn
+PRIORITY_AGEING_SECONDS = float(os.getenv('PRIORITY_AGEING_SECONDS', '120'))
+
+# Enrichment Configuration
+ENRICHMENT_ENABLED = os.getenv('ENRICHMENT_ENABLED', 'false').lower() == 'true'  # Country, local time, campaign metadata
+PHONE_CACHE_SIZE = int(os.getenv('PHONE_CACHE_SIZE', '4096'))  # Parsed phone numbers kept
+CAMPAIGN_LOOKUP_TAB = os.getenv('CAMPAIGN_LOOKUP_TAB', '')  # Tab with campaign metadata, see lead_enrichment.py
+CAMPAIGN_LOOKUP_REFRESH_MINUTES = float(os.getenv('CAMPAIGN_LOOKUP_REFRESH_MINUTES', '60'))
+
+# Sheets Quota Configuration
+QUOTA_ENABLED = os.getenv('QUOTA_ENABLED', 'true').lower() == 'true'
+QUOTA_STATE_FILE = os.getenv('QUOTA_STATE_FILE', os.path.join(tempfile.gettempdir(), 'telegram-leads-bot-quota.json'))
+SHEETS_READS_PER_MINUTE = int(os.getenv('SHEETS_READS_PER_MINUTE', '60'))  # Google's default per-user read quota
+# Resyncs only use this part of the budget
+QUOTA_LOW_PRIORITY_SHARE = float(os.getenv('QUOTA_LOW_PRIORITY_SHARE', '0.5'))
+# Enforce per-target shares above this usage
+QUOTA_FAIR_SHARE_THRESHOLD = float(os.getenv('QUOTA_FAIR_SHARE_THRESHOLD', '0.8'))
+SHEETS_RATE_LIMIT_RETRIES = int(os.getenv('SHEETS_RATE_LIMIT_RETRIES', '2'))
+
+# Circuit Breaker Configuration
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '3'))
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', '60'))
+CIRCUIT_MAX_RESET_SECONDS = float(os.getenv('CIRCUIT_MAX_RESET_SECONDS', '900'))
+
+# Health Check Configuration
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', os.getenv('PORT', '0')))  # 0 disables the HTTP endpoint
+WATCHDOG_INTERVAL_SECONDS = float(os.getenv('WATCHDOG_INTERVAL_SECONDS', '5'))
+WATCHDOG_LOOP_LAG_SECONDS = float(os.getenv('WATCHDOG_LOOP_LAG_SECONDS', '30'))
+WATCHDOG_POLL_STALE_MINUTES = float(os.getenv('WATCHDOG_POLL_STALE_MINUTES', '0'))  # 0 = three check intervals
+WATCHDOG_DELIVERY_STALL_SECONDS = float(os.getenv('WATCHDOG_DELIVERY_STALL_SECONDS', '120'))
+WATCHDOG_EXIT_ON_FAILURE = os.getenv('WATCHDOG_EXIT_ON_FAILURE', 'false').lower() == 'true'
+
+# Memory Instrumentation Configuration
+MEMSTATS_ENABLED = os.getenv('MEMSTATS_ENABLED', 'false').lower() == 'true'  # tracemalloc costs CPU and memory
+MEMSTATS_INTERVAL_SECONDS = float(os.getenv('MEMSTATS_INTERVAL_SECONDS', '600'))
+MEMSTATS_HISTORY = int(os.getenv('MEMSTATS_HISTORY', '144'))  # Samples kept for trends, a day at the default interval
+MEMSTATS_TOP_N = int(os.getenv('MEMSTATS_TOP_N', '10'))  # Allocation sites and types reported
+MEMSTATS_FRAMES = int(os.getenv('MEMSTATS_FRAMES', '1'))  # Stack frames tracemalloc stores per allocation
+COMMAND_POLL_TIMEOUT_SECONDS = int(os.getenv('COMMAND_POLL_TIMEOUT_SECONDS', '30'))  # getUpdates long-poll timeout
+
+# Traffic Trace Configuration
+TRACE_CAPTURE_FILE = os.getenv('TRACE_CAPTURE_FILE', '')  # e.g. traces/capture.jsonl, see traffic_trace.py
+
+# Backfill Configuration
+BACKFILL_WINDOW_ROWS = int(os.getenv('BACKFILL_WINDOW_ROWS', '2000'))
+BACKFILL_CHECKPOINT_FILE = os.getenv('BACKFILL_CHECKPOINT_FILE', 'backfill_checkpoint.json')
+BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', '8'))  # Leads in flight at once, within the rate limits
+TELEGRAM_CHAT_RATE_PER_SECOND = float(os.getenv('TELEGRAM_CHAT_RATE_PER_SECOND', '1'))
+TELEGRAM_GROUP_RATE_PER_SECOND = float(os.getenv('TELEGRAM_GROUP_RATE_PER_SECOND', str(20 / 60)))
+TELEGRAM_GLOBAL_RATE_PER_SECOND = float(os.getenv('TELEGRAM_GLOBAL_RATE_PER_SECOND', '30'))
+
+# Multi-tenant Configuration
+TENANTS_FILE = os.getenv('TENANTS_FILE', '')  # JSON list of clinics, see tenant_registry.py
+TENANTS_DIR = os.getenv('TENANTS_DIR', 'tenants')  # Per-tenant snapshots and checkpoints
+TENANT_SHEETS_WORKERS = int(os.getenv('TENANT_SHEETS_WORKERS', '4'))  # Threads shared by every tenant's polls
+TENANT_INIT_CONCURRENCY = int(os.getenv('TENANT_INIT_CONCURRENCY', '2'))  # Full sheet loads running at once
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '16'))  # Connections shared by every tenant's bot
+
+# Reload / Shutdown Configuration
+STATE_FILE = os.getenv('STATE_FILE', 'monitor_state.json')
+CHECKPOINT_MAX_AGE_HOURS = float(os.getenv('CHECKPOINT_MAX_AGE_HOURS', '24'))
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', '30'))
+
+
+def load_runtime_settings():
+    """
+    Re-read the settings that can change without a restart.
+
+    Only keys in CONFIG_FILE are reloaded; as at startup, a key set in the process
+    environment wins over the file, and a key missing from it keeps its startup value.
+    """
+    values = {}
+    if os.path.exists(CONFIG_FILE):
+        values = {
+            key: value for key, value in dotenv_values(CONFIG_FILE).items()
+            if value is not None and key not in _ENVIRONMENT_KEYS
+        }
+    allowed_users = values.get('TELEGRAM_ALLOWED_USERS')
+    return {
+        'allowed_users': parse_user_ids(allowed_users) if allowed_users is not None else TELEGRAM_ALLOWED_USERS,
+        'sheet_tab': values.get('GOOGLE_SHEET_TAB', GOOGLE_SHEET_TAB),
+        'check_interval_minutes': int(values.get('CHECK_INTERVAL_MINUTES', CHECK_INTERVAL_MINUTES)),
+    }
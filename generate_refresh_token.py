@@ -5,12 +5,14 @@ Run this locally to get the refresh token needed for production
 """
 
 import json
+import os
 import pickle
+import sys
 from google_auth_oauthlib.flow import InstalledAppFlow
-from config import SCOPES, CREDENTIALS_FILE
+from config import SCOPES, WRITE_SCOPES, CREDENTIALS_FILE, TOKEN_FILE, WRITE_TOKEN_FILE
 
-def generate_refresh_token():
-    """Generate a refresh token for production use"""
+def generate_refresh_token(write=False):
+    """Generate a refresh token for production use, with write access for the write-back if write is set"""
     print("=" * 60)
     print("GENERATING REFRESH TOKEN FOR RAILWAY")
     print("=" * 60)
@@ -32,11 +34,11 @@ def generate_refresh_token():
     
     try:
         # Run OAuth flow
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, WRITE_SCOPES if write else SCOPES)
         creds = flow.run_local_server(port=0)
         
         # Save token locally (for backup)
-        with open('token.json', 'wb') as token:
+        with open(WRITE_TOKEN_FILE if write else TOKEN_FILE, 'wb') as token:
             pickle.dump(creds, token)
         
         # Extract values for Railway
@@ -46,7 +48,7 @@ def generate_refresh_token():
         print("-" * 50)
         print(f"GOOGLE_CLIENT_ID={creds.client_id}")
         print(f"GOOGLE_CLIENT_SECRET={creds.client_secret}")
-        print(f"GOOGLE_REFRESH_TOKEN={creds.refresh_token}")
+        print(f"{'GOOGLE_WRITE_REFRESH_TOKEN' if write else 'GOOGLE_REFRESH_TOKEN'}={creds.refresh_token}")
         print()
         print("📋 ALSO ADD THESE (if not already set):")
         print("-" * 50)
@@ -65,5 +67,5 @@ def generate_refresh_token():
         print(f"❌ Error: {e}")
 
 if __name__ == "__main__":
-    import os
-    generate_refresh_token()
+    # --write: token for WRITEBACK_ENABLED, kept apart from the read-only one
+    generate_refresh_token(write='--write' in sys.argv[1:])
@@ -1,26 +1,66 @@
 import pickle
 import os
 import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow, Flow
 from googleapiclient.discovery import build
+from googleapiclient.http import build_http
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
-from config import SCOPES, CREDENTIALS_FILE, TOKEN_FILE, IS_PRODUCTION
+from circuit_breaker import CircuitBreaker, ServiceError
+from quota_manager import QuotaManager, PRIORITY_POLL, PRIORITY_RESYNC
+from traffic_trace import get_recorder
+from config import (
+    SCOPES, WRITE_SCOPES, CREDENTIALS_FILE, TOKEN_FILE, WRITE_TOKEN_FILE, IS_PRODUCTION,
+    SHEETS_VALUE_RENDER_OPTION, QUOTA_ENABLED, SHEETS_RATE_LIMIT_RETRIES
+)
 
 class GoogleSheetsService:
-    def __init__(self):
-        self.service = None
-        self.authenticate()
+    def __init__(self, service=None, quota=None, breaker=None, refresh_token=None, scopes=SCOPES,
+                 token_file=TOKEN_FILE):
+        self.service = service
+        self.quota = quota
+        self.breaker = breaker or CircuitBreaker('Google Sheets')
+        self.refresh_token = refresh_token  # Another Google account's token, e.g. for a tenant
+        self.scopes = scopes
+        self.token_file = token_file
+        self.credentials = None
+        self._local = threading.local()
+        if self.service is None:
+            self.authenticate()
+            if self.quota is None and QUOTA_ENABLED:
+                self.quota = QuotaManager()
+        recorder = get_recorder()
+        if recorder:
+            self.service = recorder.wrap_sheets(self.service)
+    
+    @classmethod
+    def for_writes(cls, refresh_token=None, service=None):
+        """A client authorized with WRITE_SCOPES, for the write-back only"""
+        refresh_token = refresh_token or os.getenv('GOOGLE_WRITE_REFRESH_TOKEN')
+        if service is None and IS_PRODUCTION and not refresh_token:
+            raise ValueError(
+                "WRITEBACK_ENABLED needs a token with write access in GOOGLE_WRITE_REFRESH_TOKEN.\n"
+                "Run: python generate_refresh_token.py --write"
+            )
+        writer = cls(service=service, breaker=CircuitBreaker('Google Sheets writes'), refresh_token=refresh_token,
+                     scopes=WRITE_SCOPES, token_file=WRITE_TOKEN_FILE)
+        writer.quota = None  # Writes have their own per-minute quota, and there is one per cycle
+        return writer
     
     def authenticate(self):
         """Authenticate with Google Sheets API using OAuth2"""
         creds = None
         
         # Production mode (Railway) - use environment variables
-        if IS_PRODUCTION:
+        if IS_PRODUCTION or self.refresh_token:
             client_id = os.getenv('GOOGLE_CLIENT_ID')
             client_secret = os.getenv('GOOGLE_CLIENT_SECRET')
-            refresh_token = os.getenv('GOOGLE_REFRESH_TOKEN')
+            refresh_token = self.refresh_token or os.getenv('GOOGLE_REFRESH_TOKEN')
             
             if not all([client_id, client_secret]):
                 raise ValueError(
@@ -36,7 +76,7 @@ class GoogleSheetsService:
                     token_uri="https://oauth2.googleapis.com/token",
                     client_id=client_id,
                     client_secret=client_secret,
-                    scopes=SCOPES
+                    scopes=self.scopes
                 )
                 try:
                     creds.refresh(Request())
@@ -54,8 +94,8 @@ class GoogleSheetsService:
         # Development mode (local) - use credentials file
         else:
             # Check if we have saved credentials
-            if os.path.exists(TOKEN_FILE):
-                with open(TOKEN_FILE, 'rb') as token:
+            if os.path.exists(self.token_file):
+                with open(self.token_file, 'rb') as token:
                     creds = pickle.load(token)
             
             # If there are no valid credentials, get new ones
@@ -77,38 +117,184 @@ class GoogleSheetsService:
                         )
                     
                     # Use standard desktop application flow
-                    flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+                    flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, self.scopes)
                     creds = flow.run_local_server(port=0)
                 
                 # Save the credentials for the next run
-                with open(TOKEN_FILE, 'wb') as token:
+                with open(self.token_file, 'wb') as token:
                     pickle.dump(creds, token)
         
+        self.credentials = creds
         self.service = build('sheets', 'v4', credentials=creds)
     
-    def get_sheet_data(self, sheet_id, sheet_name, range_name='A:Z'):
-        """Get all data from a specific sheet"""
-        try:
-            range_str = f'{sheet_name}!{range_name}'
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=sheet_id, 
-                range=range_str
-            ).execute()
-            return result.get('values', [])
-        except Exception as e:
-            print(f"Error getting sheet data: {e}")
-            return []
+    def _thread_http(self):
+        """This thread's authorized connection; httplib2 connections must not be shared between threads"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = AuthorizedHttp(self.credentials, http=build_http())
+        return http
     
-    def get_last_row_count(self, sheet_id, sheet_name):
-        """Get the number of rows in the sheet"""
+    def _execute(self, request, sheet_id, sheet_name, priority=PRIORITY_POLL):
+        """
+        Execute a request within the shared quota and the Sheets circuit breaker.
+        
+        Rate-limit errors are retried after backing off. Any failure is raised as ServiceError,
+        or CircuitOpenError without calling the API while the circuit is open.
+        """
+        self.breaker.before_call()
+        target = f'{sheet_id}/{sheet_name}'
         try:
-            range_str = f'{sheet_name}!A:A'
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=sheet_id, 
-                range=range_str
-            ).execute()
-            values = result.get('values', [])
-            return len(values)
+            for attempt in range(SHEETS_RATE_LIMIT_RETRIES + 1):
+                if self.quota:
+                    self.quota.acquire(target, priority)
+                try:
+                    # Each worker thread keeps its own connection alive across requests
+                    result = request.execute(http=self._thread_http()) if self.credentials else request.execute()
+                    self.breaker.record_success()
+                    return result
+                except HttpError as e:
+                    if e.resp.status != 429 or not self.quota or attempt == SHEETS_RATE_LIMIT_RETRIES:
+                        raise
+                    retry_after = e.resp.get('retry-after')
+                    print(f"Sheets API rate limited, backing off (retry-after: {retry_after})")
+                    self.quota.report_rate_limited(float(retry_after) if retry_after else None)
+        except HttpError as e:
+            # Client errors (bad range, no access) say nothing about availability
+            if e.resp.status >= 500 or e.resp.status == 429:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise ServiceError(self.breaker.name, str(e)) from e
         except Exception as e:
-            print(f"Error getting row count: {e}")
+            self.breaker.record_failure()
+            raise ServiceError(self.breaker.name, str(e)) from e
+    
+    def get_sheet_data(self, sheet_id, sheet_name, range_name='A:Z', major_dimension='ROWS',
+                       value_render_option=None, priority=PRIORITY_POLL):
+        """Get all data from a specific sheet, raising ServiceError if it can't be read"""
+        range_str = f'{sheet_name}!{range_name}'
+        # The fields mask drops the echoed range/majorDimension from the response. Responses
+        # are already gzip-compressed: googleapiclient sends accept-encoding and the
+        # "(gzip)" user-agent Google requires on every JSON request.
+        request = self.service.spreadsheets().values().get(
+            spreadsheetId=sheet_id, 
+            range=range_str,
+            majorDimension=major_dimension,
+            valueRenderOption=value_render_option or SHEETS_VALUE_RENDER_OPTION,
+            fields='values'
+        )
+        result = self._execute(request, sheet_id, sheet_name, priority)
+        return result.get('values', [])
+    
+    def get_last_row_count(self, sheet_id, sheet_name, known_rows=0):
+        """
+        Get the number of rows in the sheet, raising ServiceError if it can't be read.
+        
+        When known_rows is given only column A from that row onwards is downloaded. If that
+        row is now empty the sheet shrank, and the whole column is counted instead.
+        """
+        if known_rows:
+            tail = self._get_column_a(sheet_id, sheet_name, known_rows)
+            if tail and tail[0] != "":
+                return known_rows - 1 + len(tail)
+        return len(self._get_column_a(sheet_id, sheet_name, 1))
+    
+    def _get_column_a(self, sheet_id, sheet_name, first_row):
+        """Return column A from first_row down as a flat list"""
+        # COLUMNS returns one flat list instead of a one-element list per row, and the
+        # unformatted values skip number/date formatting we don't need for counting
+        request = self.service.spreadsheets().values().get(
+            spreadsheetId=sheet_id,
+            range=f'{sheet_name}!A{first_row}:A',
+            majorDimension='COLUMNS',
+            valueRenderOption='UNFORMATTED_VALUE',
+            fields='values'
+        )
+        result = self._execute(request, sheet_id, sheet_name)
+        values = result.get('values', [])
+        return values[0] if values else []
+    
+    def write_column_cells(self, sheet_id, sheet_name, column, values_by_row):
+        """
+        Write {row_number: value} into one column with a single values.batchUpdate, consecutive
+        rows sharing one range. Returns the number of updated cells, raises ServiceError on failure.
+        """
+        runs = []  # (first row number, values)
+        for row_number in sorted(values_by_row):
+            if runs and runs[-1][0] + len(runs[-1][1]) == row_number:
+                runs[-1][1].append(values_by_row[row_number])
+            else:
+                runs.append((row_number, [values_by_row[row_number]]))
+        if not runs:
             return 0
+        
+        request = self.service.spreadsheets().values().batchUpdate(
+            spreadsheetId=sheet_id,
+            body={
+                # Parsed like typed input, so timestamps become real date-times in the sheet
+                'valueInputOption': 'USER_ENTERED',
+                'data': [
+                    {'range': f'{sheet_name}!{column}{first}:{column}{first + len(values) - 1}',
+                     'majorDimension': 'COLUMNS', 'values': [values]}
+                    for first, values in runs
+                ],
+            },
+            fields='totalUpdatedCells'
+        )
+        result = self._execute(request, sheet_id, sheet_name)
+        return result.get('totalUpdatedCells', 0)
+    
+    def iter_sheet_windows(self, sheet_id, sheet_name, window_size, start_row=1, end_row=None,
+                           last_column='Z', prefetch=0, priority=PRIORITY_RESYNC):
+        """
+        Yield (first_row_number, rows) for consecutive windows of at most window_size rows.
+
+        When end_row is given every window up to it is read, otherwise reading stops at the
+        first empty window. With prefetch > 0 up to that many windows are requested ahead of
+        the consumer on a single background thread, so one load never issues requests
+        concurrently. Windows are low-priority reads by default,
+        so a large load yields the quota to scheduled polls.
+        """
+        def window_bounds():
+            first = start_row
+            while end_row is None or first <= end_row:
+                last = first + window_size - 1
+                if end_row is not None:
+                    last = min(last, end_row)
+                yield first, last
+                first = last + 1
+        
+        def fetch(first, last):
+            return first, self.get_sheet_data(
+                sheet_id, sheet_name, f'A{first}:{last_column}{last}', priority=priority
+            )
+        
+        if not prefetch:
+            for first, last in window_bounds():
+                first, rows = fetch(first, last)
+                if not rows and end_row is None:
+                    return
+                yield first, rows
+            return
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            bounds = window_bounds()
+            pending = deque()
+            try:
+                for _ in range(prefetch + 1):
+                    window = next(bounds, None)
+                    if window is None:
+                        break
+                    pending.append(executor.submit(fetch, *window))
+                
+                while pending:
+                    first, rows = pending.popleft().result()
+                    if not rows and end_row is None:
+                        return
+                    window = next(bounds, None)
+                    if window is not None:
+                        pending.append(executor.submit(fetch, *window))
+                    yield first, rows
+            finally:
+                for future in pending:
+                    future.cancel()
@@ -0,0 +1,200 @@
+"""
+Health endpoint and watchdog for the leads monitor.
+
+GET /healthz returns 200 while the bot is healthy and 503 otherwise, GET /metrics returns
+the full status as JSON. In multi-tenant mode a failing clinic is only reported in /metrics,
+/healthz fails when the process itself is unhealthy or every clinic is failing. The watchdog
+runs on its own thread so it still fires when the event loop itself is blocked (e.g. by a
+hung `.execute()` call).
+"""
+
+import asyncio
+import faulthandler
+import json
+import os
+import sys
+import threading
+import time
+from config import (
+    HEALTH_PORT, WATCHDOG_INTERVAL_SECONDS, WATCHDOG_LOOP_LAG_SECONDS, WATCHDOG_POLL_STALE_MINUTES,
+    WATCHDOG_DELIVERY_STALL_SECONDS, WATCHDOG_EXIT_ON_FAILURE
+)
+
+
+class HealthMonitor:
+    """Serves /healthz and watches event-loop lag, poll freshness and stuck deliveries"""
+
+    def __init__(self, monitor, port=HEALTH_PORT, exit_on_failure=WATCHDOG_EXIT_ON_FAILURE, memory=None):
+        self.monitor = monitor
+        self.memory = memory  # MemoryProfiler whose report is added to /metrics
+        self.port = port
+        self.exit_on_failure = exit_on_failure
+        self.started_at = time.time()
+        self.loop = None
+        self.last_beat = time.monotonic()
+        self.loop_lag = 0.0
+        self.max_loop_lag = 0.0
+        self.server = None
+        self._heartbeat_task = None
+        self._dumped = False
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat(), name="health-heartbeat")
+        threading.Thread(target=self._watchdog, name="health-watchdog", daemon=True).start()
+        if self.port:
+            self.server = await asyncio.start_server(self._handle, '0.0.0.0', self.port)
+            print(f"Health endpoint listening on port {self.port}")
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _heartbeat(self):
+        """Measure how late the loop wakes us up compared to the requested sleep"""
+        interval = 1.0
+        while True:
+            scheduled = self.loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag = max(0.0, self.loop.time() - scheduled - interval)
+            self.max_loop_lag = max(self.max_loop_lag, self.loop_lag)
+            self.last_beat = time.monotonic()
+
+    def _monitors(self):
+        """
+        name -> LeadsMonitor being watched; a TenantRegistry has one per clinic. A copy, since
+        the watchdog thread reads it while the event loop adds and removes tenants.
+        """
+        if hasattr(self.monitor, 'tenants'):
+            return dict(list(self.monitor.tenants.items()))
+        return {'': self.monitor}
+
+    def _poll_stale_seconds(self, monitor):
+        if WATCHDOG_POLL_STALE_MINUTES:
+            return WATCHDOG_POLL_STALE_MINUTES * 60
+        return 3 * monitor.check_interval_minutes * 60
+
+    def monitor_problems(self, monitor):
+        """Stale polls and stuck deliveries of one monitor"""
+        problems = []
+        now = time.time()
+        last_poll = monitor.last_poll_ok_at or max(self.started_at, monitor.started_at)
+        if now - last_poll > self._poll_stale_seconds(monitor):
+            problems.append(f"no successful poll for {now - last_poll:.0f}s")
+
+        pipeline = monitor.pipeline
+        if pipeline:
+            for stage in list(pipeline.stages):
+                if stage.name == 'sender' and stage.longest_running() > WATCHDOG_DELIVERY_STALL_SECONDS:
+                    problems.append(f"delivery stuck for {stage.longest_running():.0f}s")
+        return problems
+
+    def problems(self):
+        """Return a list of human-readable reasons the bot is unhealthy (empty when healthy)"""
+        problems = []
+
+        stalled_for = time.monotonic() - self.last_beat
+        if stalled_for > WATCHDOG_LOOP_LAG_SECONDS:
+            problems.append(f"event loop blocked for {stalled_for:.0f}s")
+        elif self.loop_lag > WATCHDOG_LOOP_LAG_SECONDS:
+            problems.append(f"event loop lag {self.loop_lag:.1f}s")
+
+        monitors = self._monitors()
+        failing = [name for name, monitor in monitors.items() if self.monitor_problems(monitor)]
+        if not hasattr(self.monitor, 'tenants'):
+            problems.extend(self.monitor_problems(self.monitor))
+        elif monitors and len(failing) == len(monitors):
+            # A single broken clinic must not get every clinic restarted, all of them failing
+            # points at the process itself
+            problems.append(f"all {len(monitors)} tenants failing")
+        return problems
+
+    def status(self):
+        problems = self.problems()
+        status = {
+            'healthy': not problems,
+            'problems': problems,
+            'uptime_seconds': round(time.time() - self.started_at),
+            'loop_lag_seconds': round(self.loop_lag, 3),
+            'max_loop_lag_seconds': round(self.max_loop_lag, 3),
+        }
+        if hasattr(self.monitor, 'tenants'):
+            status.update(self.monitor.stats())
+            for name, monitor in self._monitors().items():
+                if name in status['tenants']:
+                    status['tenants'][name]['problems'] = self.monitor_problems(monitor)
+        else:
+            status.update(self.monitor.metrics())
+        if self.memory:
+            status['memory'] = self.memory.report()
+        return status
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) > 1 else '/'
+
+            if path == '/healthz':
+                problems = self.problems()
+                status = 200 if not problems else 503
+                body = {'healthy': not problems, 'problems': problems}
+            elif path == '/metrics':
+                status, body = 200, self.status()
+            else:
+                status, body = 404, {'error': 'not found'}
+
+            payload = json.dumps(body).encode('utf-8')
+            reason = {200: 'OK', 404: 'Not Found', 503: 'Service Unavailable'}[status]
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            print(f"Error serving health request: {e}")
+        finally:
+            writer.close()
+
+    def _dump_stacks(self):
+        """Print every thread's stack, and every asyncio task's stack when the loop still runs"""
+        print("=" * 60, file=sys.stderr)
+        print("Watchdog: dumping thread stacks", file=sys.stderr)
+        faulthandler.dump_traceback(file=sys.stderr, all_threads=True)
+        if time.monotonic() - self.last_beat < WATCHDOG_LOOP_LAG_SECONDS:
+            self.loop.call_soon_threadsafe(self._dump_task_stacks)
+
+    def _dump_task_stacks(self):
+        print("Watchdog: dumping asyncio task stacks", file=sys.stderr)
+        for task in asyncio.all_tasks(self.loop):
+            print(f"--- {task.get_name()}", file=sys.stderr)
+            task.print_stack(file=sys.stderr)
+
+    def _watchdog(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL_SECONDS)
+            try:
+                problems = self.problems()
+            except Exception as e:
+                # State changes on the event loop while it is read here; a failed check must
+                # not end the thread and leave the bot without a watchdog
+                print(f"Watchdog: health check failed, retrying: {e}")
+                continue
+            if not problems:
+                self._dumped = False
+                continue
+
+            # Only dump once per unhealthy episode
+            if not self._dumped:
+                print(f"⚠️  Watchdog: unhealthy: {'; '.join(problems)}")
+                self._dump_stacks()
+                self._dumped = True
+            if self.exit_on_failure:
+                time.sleep(1)  # Give the task stack dump a chance to run on the loop
+                print("Watchdog: exiting so the platform restarts the bot", file=sys.stderr)
+                sys.stderr.flush()
+                sys.stdout.flush()
+                os._exit(1)
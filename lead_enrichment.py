@@ -0,0 +1,187 @@
+"""
+Lead enrichment: what sales wants to know before calling, joined in memory at render time.
+
+- From the phone number, the lead's country and local time. Numbers are parsed offline with
+  the optional `phonenumbers` package when it is installed (pip install phonenumbers),
+  otherwise by their country code against CALLING_CODES; results are cached per phone cell
+  (PHONE_CACHE_SIZE entries). Only numbers written with their country code ("+60 ...",
+  "0060 ...") are placed, a local number says nothing reliable about where the lead is.
+- From the campaign name, the campaign's metadata (budget owner, landing page, ...) read from
+  a lookup tab (CAMPAIGN_LOOKUP_TAB) of the leads sheet:
+
+    Campaign Name          | Budget Owner | Landing Page
+    Eye Bag Removal Q4     | Yuki         | https://tokyogarden.sg/eye-bags
+    Dark Circles Promo     | Kenji        | https://tokyogarden.sg/dark-circles
+
+  The first column holds the campaign names, matched case-insensitively, and every other
+  column with a header is shown. The tab is read once at start and then every
+  CAMPAIGN_LOOKUP_REFRESH_MINUTES in the background, never while a lead is being rendered.
+"""
+
+import re
+import time
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from lead_schema import PHONE_COLUMN, CAMPAIGN_COLUMN
+from quota_manager import PRIORITY_RESYNC
+from circuit_breaker import ServiceError
+from config import PHONE_CACHE_SIZE, CAMPAIGN_LOOKUP_REFRESH_MINUTES
+
+try:
+    import phonenumbers
+    from phonenumbers import geocoder, timezone as phone_timezones
+except ImportError:  # Fall back to the calling-code table below
+    phonenumbers = None
+
+_NON_DIGITS = re.compile(r'\D')
+LOOKUP_RETRY_SECONDS = 60  # Retry delay after a failed lookup tab read
+LOOKUP_LAST_COLUMN = 'Z'
+LOCAL_TIME_FORMAT = '%H:%M (%a)'
+
+# Calling code -> (region, country, time zone) for the countries leads come from. Countries
+# spanning several zones get their most populous one.
+CALLING_CODES = {
+    '1': ('US', 'United States / Canada', 'America/New_York'),
+    '33': ('FR', 'France', 'Europe/Paris'),
+    '44': ('GB', 'United Kingdom', 'Europe/London'),
+    '49': ('DE', 'Germany', 'Europe/Berlin'),
+    '60': ('MY', 'Malaysia', 'Asia/Kuala_Lumpur'),
+    '61': ('AU', 'Australia', 'Australia/Sydney'),
+    '62': ('ID', 'Indonesia', 'Asia/Jakarta'),
+    '63': ('PH', 'Philippines', 'Asia/Manila'),
+    '64': ('NZ', 'New Zealand', 'Pacific/Auckland'),
+    '65': ('SG', 'Singapore', 'Asia/Singapore'),
+    '66': ('TH', 'Thailand', 'Asia/Bangkok'),
+    '81': ('JP', 'Japan', 'Asia/Tokyo'),
+    '82': ('KR', 'South Korea', 'Asia/Seoul'),
+    '84': ('VN', 'Vietnam', 'Asia/Ho_Chi_Minh'),
+    '86': ('CN', 'China', 'Asia/Shanghai'),
+    '91': ('IN', 'India', 'Asia/Kolkata'),
+    '95': ('MM', 'Myanmar', 'Asia/Yangon'),
+    '673': ('BN', 'Brunei', 'Asia/Brunei'),
+    '852': ('HK', 'Hong Kong', 'Asia/Hong_Kong'),
+    '853': ('MO', 'Macau', 'Asia/Macau'),
+    '855': ('KH', 'Cambodia', 'Asia/Phnom_Penh'),
+    '856': ('LA', 'Laos', 'Asia/Vientiane'),
+    '886': ('TW', 'Taiwan', 'Asia/Taipei'),
+    '971': ('AE', 'United Arab Emirates', 'Asia/Dubai'),
+}
+
+
+def _zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def phone_region(value):
+    """(region, country, ZoneInfo or None) of a phone number cell, None if it can't be placed"""
+    value = str(value).strip()
+    digits = _NON_DIGITS.sub('', value)
+    if value.startswith('00'):
+        digits = digits[2:]  # International call prefix
+    elif not value.startswith('+'):
+        return None  # No country code
+    # E.164 allows at most 15 digits; anything under 8 is an extension or a typo
+    if not 8 <= len(digits) <= 15:
+        return None
+    if phonenumbers:
+        try:
+            number = phonenumbers.parse('+' + digits)
+        except phonenumbers.NumberParseException:
+            return None
+        if not phonenumbers.is_possible_number(number):
+            return None
+        region = phonenumbers.region_code_for_number(number)
+        if not region or region == 'ZZ':
+            return None
+        zones = [name for name in phone_timezones.time_zones_for_number(number) if name != 'Etc/Unknown']
+        return region, geocoder.country_name_for_number(number, 'en') or region, _zone(zones[0]) if zones else None
+    for length in (3, 2, 1):  # Calling codes are prefix-free
+        match = CALLING_CODES.get(digits[:length])
+        if match:
+            region, country, zone_name = match
+            return region, country, _zone(zone_name)
+    return None
+
+
+class CampaignDirectory:
+    """The campaign lookup tab, kept in memory and refreshed on its own schedule"""
+
+    def __init__(self, sheets_service, sheet_id, tab, refresh_minutes=CAMPAIGN_LOOKUP_REFRESH_MINUTES):
+        self.sheets_service = sheets_service
+        self.sheet_id = sheet_id
+        self.tab = tab
+        self.refresh_seconds = refresh_minutes * 60
+        self.campaigns = {}  # Lowercase campaign name -> [(label, value), ...]
+        self.loaded_at = None  # time.time() of the last successful read
+        self.refresh_errors = 0
+        self._next_refresh = 0.0  # time.monotonic() when the tab is due to be read again
+
+    def is_due(self):
+        return time.monotonic() >= self._next_refresh
+
+    def refresh(self):
+        """Re-read the tab (blocking, run it off the event loop); keeps the old table on errors"""
+        try:
+            rows = self.sheets_service.get_sheet_data(
+                self.sheet_id, self.tab, f'A1:{LOOKUP_LAST_COLUMN}', priority=PRIORITY_RESYNC
+            )
+        except ServiceError as e:
+            self.refresh_errors += 1
+            self._next_refresh = time.monotonic() + min(LOOKUP_RETRY_SECONDS, self.refresh_seconds)
+            print(f"Could not read campaign lookup tab {self.tab}, keeping {len(self.campaigns)} campaigns: {e}")
+            return
+        headers = [str(header).strip() for header in rows[0]] if rows else []
+        campaigns = {}
+        for row in rows[1:]:
+            if not row or not str(row[0]).strip():
+                continue
+            campaigns[str(row[0]).strip().lower()] = [
+                (headers[i], str(value).strip())
+                for i, value in enumerate(row[1:], 1)
+                if i < len(headers) and headers[i] and str(value).strip()
+            ]
+        self.campaigns = campaigns
+        self.loaded_at = time.time()
+        self._next_refresh = time.monotonic() + self.refresh_seconds
+        print(f"Loaded {len(campaigns)} campaigns from lookup tab {self.tab}")
+
+    def lookup(self, campaign):
+        return self.campaigns.get(str(campaign).strip().lower(), ())
+
+    def stats(self):
+        return {
+            'campaigns': len(self.campaigns),
+            'seconds_since_load': round(time.time() - self.loaded_at) if self.loaded_at else None,
+            'refresh_errors': self.refresh_errors,
+        }
+
+
+def enrich_lead(row, campaigns=None):
+    """(label, value) lines to add to a lead's notification, from in-memory data only"""
+    lines = []
+    region = phone_region(row[PHONE_COLUMN]) if len(row) > PHONE_COLUMN and row[PHONE_COLUMN] else None
+    if region:
+        _, country, zone = region
+        lines.append(("🌏 Country", country))
+        if zone:
+            lines.append(("🕒 Local Time", datetime.now(zone).strftime(LOCAL_TIME_FORMAT)))
+    if campaigns and len(row) > CAMPAIGN_COLUMN and row[CAMPAIGN_COLUMN]:
+        lines.extend((f"📌 {label}", value) for label, value in campaigns.lookup(row[CAMPAIGN_COLUMN]))
+    return lines
+
+
+def enrichment_stats(campaigns=None):
+    """Phone cache and campaign table figures for /metrics"""
+    cache = phone_region.cache_info()
+    stats = {
+        'phone_parser': 'phonenumbers' if phonenumbers else 'calling codes',
+        'phone_cache': {'hits': cache.hits, 'misses': cache.misses, 'size': cache.currsize},
+    }
+    if campaigns:
+        stats['campaign_lookup'] = campaigns.stats()
+    return stats
@@ -0,0 +1,115 @@
+"""
+Lead IDs, contact keys and their 64-bit fingerprints, the dedup keys of the monitor.
+
+This module only depends on the snapshot reader, so resync worker processes can import it
+without loading the Google and Telegram clients.
+"""
+
+import hashlib
+import re
+from array import array
+from lead_snapshot import LeadSnapshot
+from lead_schema import EMAIL_COLUMN, PHONE_COLUMN
+from config import PHONE_DEFAULT_COUNTRY_CODE
+
+KEY_COLUMNS = (1, 2, 3)  # Submission date, name and email
+GMAIL_DOMAINS = ('gmail.com', 'googlemail.com')
+_NON_DIGITS = re.compile(r'\D')
+MIN_NATIONAL_DIGITS = 8  # Shorter numbers starting with the country code are national numbers
+
+
+def lead_id_for_row(row):
+    """Unique ID of a lead based on name, email and date, None for rows with fewer than 4 cells"""
+    if len(row) < 4:
+        return None
+    return f"{row[2]}_{row[3]}_{row[1]}".strip()
+
+
+def lead_fingerprint(lead_id):
+    """Hash a lead ID to a 64-bit integer, much smaller to keep in memory than the ID string"""
+    return int.from_bytes(hashlib.blake2b(lead_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def normalize_email(value):
+    """
+    Lower-case an address and drop its +tag, and for Gmail the dots in the local part, which
+    Gmail ignores: " John.Tan+promo@GoogleMail.com" -> "johntan@gmail.com". None if invalid.
+    """
+    local, _, domain = str(value).strip().lower().rpartition('@')
+    if not local or '.' not in domain:
+        return None
+    local = local.split('+', 1)[0]
+    if domain in GMAIL_DOMAINS:
+        local = local.replace('.', '')
+        domain = 'gmail.com'
+    return f"{local}@{domain}" if local else None
+
+
+def normalize_phone(value, default_country_code=PHONE_DEFAULT_COUNTRY_CODE):
+    """
+    Best-effort E.164 form of a phone number: "+65 9123 4567", "6591234567", "0065-91234567"
+    and "91234567" all become "+6591234567". Numbers without a country code are taken to be
+    in default_country_code (a national trunk 0 is dropped). None if it can't be a number.
+    """
+    value = str(value).strip()
+    digits = _NON_DIGITS.sub('', value)
+    if not value.startswith('+'):
+        if digits.startswith('00'):
+            digits = digits[2:]  # International call prefix
+        elif not (digits.startswith(default_country_code)
+                  and len(digits) >= len(default_country_code) + MIN_NATIONAL_DIGITS):
+            digits = default_country_code + digits.lstrip('0')
+    # E.164 allows at most 15 digits; anything under 8 is an extension or a typo
+    if not 8 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+
+def contact_fingerprints(row):
+    """(field, fingerprint) of the lead's normalized email and phone, the blocking keys for repeat leads"""
+    keys = []
+    if len(row) > EMAIL_COLUMN and row[EMAIL_COLUMN]:
+        email = normalize_email(row[EMAIL_COLUMN])
+        if email:
+            keys.append(('email', lead_fingerprint('email:' + email)))
+    if len(row) > PHONE_COLUMN and row[PHONE_COLUMN]:
+        phone = normalize_phone(row[PHONE_COLUMN])
+        if phone:
+            keys.append(('phone', lead_fingerprint('phone:' + phone)))
+    return keys
+
+
+def fingerprint_rows(rows):
+    """Lead and contact fingerprints of rows, each packed as uint64 bytes"""
+    fingerprints = array('Q')
+    contacts = array('Q')
+    for row in rows:
+        lead_id = lead_id_for_row(row)
+        if lead_id:
+            fingerprints.append(lead_fingerprint(lead_id))
+        contacts.extend(fingerprint for _, fingerprint in contact_fingerprints(row))
+    return fingerprints.tobytes(), contacts.tobytes()
+
+
+def fingerprint_snapshot_rows(directory, start, end):
+    """
+    Fingerprints of snapshot rows start..end-1 (zero-based, row 0 is the header).
+
+    Runs in a worker process: only the row range goes in and packed fingerprints come out,
+    the rows themselves are read from the memory-mapped snapshot and never pickled.
+    """
+    snapshot = LeadSnapshot(directory).open_read_only()
+    try:
+        columns = [snapshot.column(index) for index in range(snapshot.num_columns)]
+        date, name, email = (columns[index] for index in KEY_COLUMNS)
+        phone = columns[PHONE_COLUMN]
+        trailing = columns[KEY_COLUMNS[-1]:]
+
+        def key_rows():
+            for row in range(start, min(end, snapshot.row_count)):
+                # The API trims trailing empty cells: a row has 4+ cells if any cell from D on is set
+                if any(column.raw(row) for column in trailing):
+                    yield ("", date[row], name[row], email[row], phone[row])
+        return fingerprint_rows(key_rows())
+    finally:
+        snapshot.close()
@@ -0,0 +1,244 @@
+"""
+Lead routing: decide which chats receive each lead.
+
+Rules are loaded from a JSON file (ROUTING_RULES_FILE):
+
+{
+  "groups": {"underarm_team": [111111, 222222], "eye_team": [333333]},
+  "rules": [
+    {"name": "underarm", "when": {"Underarm Concerns": {"nonempty": true}}, "to": ["underarm_team"]},
+    {"name": "eye ig", "when": {"Campaign Name": ["Eye Bag Removal Q4", "Dark Circles Promo"], "Platform": "ig"},
+     "to": ["eye_team", -100987654]}
+  ],
+  "default": "all",
+  "priorities": [
+    {"name": "appointment today", "when": {"Preferred Appointment Time": {"today": true}}, "priority": 0},
+    {"name": "wants a call", "when": {"Contact Preference": {"contains": "call"}}, "priority": 1}
+  ],
+  "default_priority": 2
+}
+
+Columns are referenced by sheet label ("Campaign Name"), A1 letter ("G") or zero-based
+index (6). A condition is a value (case-insensitive equality), a list of values (any of),
+{"nonempty": true/false}, {"contains": "call"} (case-insensitive substring, or a list of
+them) or {"today": true/false} (the cell says "today" or holds today's date). All
+conditions of a rule must hold. Leads matching no rule go to "default": "all" (every
+allowed user, the default) or a list of chats/groups.
+
+"priorities" rank leads for delivery, 0 being the most urgent: a lead gets the lowest
+priority of the rules it matches, or "default_priority" (one below the least urgent rule).
+"""
+
+import json
+from collections import defaultdict
+from datetime import date
+from lead_schema import FIELD_MAPPING, column_letter
+
+ALL_USERS = "all"
+CONDITION_KINDS = ('nonempty', 'contains', 'today')
+TODAY_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%B %d %Y', '%d %B %Y', '%b %d %Y', '%d %b %Y')
+
+
+def _normalize(value):
+    return str(value).strip().lower()
+
+
+def _mentions_today(cell):
+    """True if the cell says "today" or contains today's date in one of the usual formats"""
+    cell = _normalize(cell)
+    if 'today' in cell:
+        return True
+    today = date.today()
+    return any(today.strftime(date_format).lower() in cell for date_format in TODAY_FORMATS)
+
+
+def _field_labels():
+    """Map lowercase sheet labels (without their emoji) to column indexes"""
+    labels = {}
+    for index, label in FIELD_MAPPING.items():
+        labels[_normalize(label.split(' ', 1)[-1])] = index
+    return labels
+
+
+def resolve_column(name):
+    """Resolve a column reference (label, unique label prefix, A1 letter or index)"""
+    if isinstance(name, int) or str(name).isdigit():
+        return int(name)
+
+    labels = _field_labels()
+    wanted = _normalize(name)
+    if wanted in labels:
+        return labels[wanted]
+    for index in range(max(FIELD_MAPPING) + 1):
+        if column_letter(index) == str(name).strip().upper():
+            return index
+    prefixed = [index for label, index in labels.items() if label.startswith(wanted)]
+    if len(prefixed) == 1:
+        return prefixed[0]
+    raise ValueError(f"Unknown column '{name}' in routing rules")
+
+
+class LeadRouter:
+    """
+    Routing rules compiled into an inverted index.
+
+    Each rule is indexed under its most selective condition only (its anchor), keyed by
+    (column, value) or (column, is_nonempty). Routing a row looks up each indexed column
+    once and fully checks just the rules found there, so the cost grows with the number of
+    candidate rules rather than with the total number of rules. Rules with only "contains"
+    and "today" conditions can't be looked up and are checked for every row.
+    """
+
+    def __init__(self, rules, groups=None, default=ALL_USERS, priorities=None, default_priority=None):
+        self.groups = {name: [int(chat_id) for chat_id in chats] for name, chats in (groups or {}).items()}
+        self.rule_names = []
+        self.rule_targets = []
+        self.rule_conditions = []  # [(column, kind, argument)], kind is 'equals' or one of CONDITION_KINDS
+        self.always = []  # Rules without an indexable condition
+        self.index = {}  # (column, key) -> [rule], key is a normalized value or ('nonempty', bool)
+
+        for rule in rules:
+            self._compile_rule(rule)
+        self._build_index()
+
+        self.indexed_columns = sorted({column for column, _ in self.index})
+        self.default = default if default == ALL_USERS else self._resolve_targets(default)
+
+        self.priority_rules = [
+            (self._compile_conditions(rule.get('when', {}), rule.get('name', f"priority {number}")),
+             int(rule['priority']))
+            for number, rule in enumerate(priorities or [], 1)
+        ]
+        if default_priority is None:
+            default_priority = max((priority for _, priority in self.priority_rules), default=-1) + 1
+        self.default_priority = int(default_priority)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as rules_file:
+            config = json.load(rules_file)
+        return cls(config.get('rules', []), config.get('groups'), config.get('default', ALL_USERS),
+                   config.get('priorities'), config.get('default_priority'))
+
+    def _resolve_targets(self, targets):
+        if not isinstance(targets, list):
+            targets = [targets]
+        chat_ids = set()
+        for target in targets:
+            if isinstance(target, str) and not target.lstrip('-').isdigit():
+                if target not in self.groups:
+                    raise ValueError(f"Unknown recipient group '{target}' in routing rules")
+                chat_ids.update(self.groups[target])
+            else:
+                chat_ids.add(int(target))
+        return frozenset(chat_ids)
+
+    @staticmethod
+    def _compile_conditions(when, name):
+        conditions = []
+        for column_name, condition in when.items():
+            column = resolve_column(column_name)
+            if isinstance(condition, dict):
+                if len(condition) != 1 or next(iter(condition)) not in CONDITION_KINDS:
+                    raise ValueError(f"Unsupported condition {condition} in rule '{name}'")
+                kind, argument = next(iter(condition.items()))
+                if kind == 'contains':
+                    parts = argument if isinstance(argument, list) else [argument]
+                    argument = tuple(_normalize(part) for part in parts)
+                else:
+                    argument = bool(argument)
+                conditions.append((column, kind, argument))
+            else:
+                values = condition if isinstance(condition, list) else [condition]
+                conditions.append((column, 'equals', frozenset(_normalize(value) for value in values)))
+        return conditions
+
+    def _compile_rule(self, rule):
+        name = rule.get('name', f"rule {len(self.rule_names) + 1}")
+        conditions = self._compile_conditions(rule.get('when', {}), name)
+        self.rule_names.append(name)
+        self.rule_targets.append(self._resolve_targets(rule.get('to', [])))
+        self.rule_conditions.append(conditions)
+
+    @staticmethod
+    def _condition_keys(condition):
+        column, kind, argument = condition
+        if kind == 'equals':
+            return [(column, value) for value in argument]
+        if kind == 'nonempty':
+            return [(column, ('nonempty', argument))]
+        return []  # Substrings and dates can't be looked up, they are only checked
+
+    def _build_index(self):
+        key_counts = defaultdict(int)
+        for conditions in self.rule_conditions:
+            for condition in conditions:
+                for key in self._condition_keys(condition):
+                    key_counts[key] += 1
+
+        for rule_index, conditions in enumerate(self.rule_conditions):
+            indexable = [condition for condition in conditions if self._condition_keys(condition)]
+            if not indexable:
+                self.always.append(rule_index)
+                continue
+            # Anchor on the condition shared with the fewest other rules
+            anchor = min(indexable, key=lambda condition: sum(
+                key_counts[key] for key in self._condition_keys(condition)
+            ))
+            for key in self._condition_keys(anchor):
+                self.index.setdefault(key, []).append(rule_index)
+
+    @property
+    def recipients(self):
+        """Every chat any rule can route to"""
+        chat_ids = set()
+        for targets in self.rule_targets:
+            chat_ids.update(targets)
+        if self.default != ALL_USERS:
+            chat_ids.update(self.default)
+        return chat_ids
+
+    @staticmethod
+    def _holds(condition, row):
+        column, kind, argument = condition
+        cell = str(row[column]) if column < len(row) else ""
+        if kind == 'equals':
+            return _normalize(cell) in argument
+        if kind == 'nonempty':
+            return bool(cell.strip()) == argument
+        if kind == 'contains':
+            cell = _normalize(cell)
+            return any(part in cell for part in argument)
+        return _mentions_today(cell) == argument
+
+    def _all_hold(self, conditions, row):
+        return all(self._holds(condition, row) for condition in conditions)
+
+    def matching_rules(self, row):
+        """Return the indexes of all rules whose conditions hold for row"""
+        matched = [rule_index for rule_index in self.always if self._all_hold(self.rule_conditions[rule_index], row)]
+        for column in self.indexed_columns:
+            cell = str(row[column]) if column < len(row) else ""
+            for key in (_normalize(cell), ('nonempty', bool(cell.strip()))):
+                for rule_index in self.index.get((column, key), ()):
+                    if self._all_hold(self.rule_conditions[rule_index], row):
+                        matched.append(rule_index)
+        return matched
+
+    def route(self, row, all_users):
+        """Return the chat IDs that should receive this lead"""
+        matched = self.matching_rules(row)
+        if not matched:
+            return list(all_users) if self.default == ALL_USERS else sorted(self.default)
+
+        chat_ids = set()
+        for rule_index in matched:
+            chat_ids.update(self.rule_targets[rule_index])
+        return sorted(chat_ids)
+
+    def priority(self, row):
+        """Delivery priority of the lead, 0 being the most urgent"""
+        return min(
+            (priority for conditions, priority in self.priority_rules if self._all_hold(conditions, row)),
+            default=self.default_priority,
+        )
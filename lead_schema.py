@@ -0,0 +1,53 @@
+"""
+Column layout of the leads sheet, shared by the notification renderer and the Sheets requests.
+"""
+
+from datetime import datetime
+
+# Map actual columns from your Google Sheet
+FIELD_MAPPING = {
+    0: "📝 Form Type",
+    1: "📅 Submission Date",
+    2: "👤 Name",
+    3: "📧 Email",
+    4: "📱 Phone",
+    5: "🌐 Platform",
+    6: "📢 Campaign Name",
+    7: "🎯 Adset Name",
+    8: "📺 Ad Name",
+    9: "💪 Underarm Concerns",
+    10: "👁️ Eye Area Concerns",
+    11: "⏰ Duration of Concern",
+    12: "📅 Preferred Appointment Time",
+    13: "📞 Contact Preference",
+    14: "📊 Status"
+}
+
+SUBMISSION_DATE_COLUMN = 1
+SUBMISSION_DATE_FORMAT = "%B %d %Y %H:%M:%S"  # e.g. "October 16 2025 14:00:15"
+EMAIL_COLUMN = 3
+PHONE_COLUMN = 4
+CAMPAIGN_COLUMN = 6
+
+# Display key information first
+KEY_FIELDS = [2, 3, 4, 1, 5, 14]  # Name, Email, Phone, Date, Platform, Status
+ADDITIONAL_FIELDS = [0, 6, 7, 8, 9, 10, 11, 12, 13]
+
+
+def column_letter(index):
+    """Convert a zero-based column index to its A1 letter (0 -> A, 26 -> AA)"""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def parse_submission_date(value):
+    """Parse the sheet's submission date, raising ValueError for anything else"""
+    return datetime.strptime(value, SUBMISSION_DATE_FORMAT)
+
+
+# Last column any part of the bot reads, requests never need to go past it
+RENDERED_LAST_COLUMN = column_letter(max(FIELD_MAPPING))
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Local columnar snapshot of the monitored Google Sheet.
+
+Each column is stored as two append-only files:
+  col_XX.dat - the UTF-8 encoded cell values, concatenated
+  col_XX.idx - one unsigned 64-bit end offset per row into col_XX.dat
+
+Both files are memory-mapped on load, so opening a snapshot of a large sheet
+costs no parsing and filters only touch the columns they reference.
+
+Usage:
+  python lead_snapshot.py info
+  python lead_snapshot.py query --where "Platform=fb" --where "Name~tan" --columns Name,Email
+"""
+
+import argparse
+import csv
+import json
+import mmap
+import os
+import sys
+from array import array
+from config import SNAPSHOT_DIR, SNAPSHOT_COLUMNS
+from lead_schema import column_letter
+
+META_FILE = 'meta.json'
+OFFSET_SIZE = array('Q').itemsize
+
+
+class _Column:
+    """Read-only view over one memory-mapped column"""
+
+    def __init__(self, data_path, index_path, row_count):
+        self._data_file = open(data_path, 'rb')
+        self._index_file = open(index_path, 'rb')
+        self._data = self._map(self._data_file)
+        self._index = self._map(self._index_file)
+        self._offsets = memoryview(self._index).cast('Q') if self._index else None
+        self.row_count = row_count
+
+    @staticmethod
+    def _map(handle):
+        # mmap refuses zero-length files, an empty column simply has no map
+        if os.fstat(handle.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def raw(self, row):
+        """Return the encoded bytes of a cell without decoding them"""
+        end = self._offsets[row]
+        start = self._offsets[row - 1] if row else 0
+        return self._data[start:end] if end > start else b""
+
+    def __getitem__(self, row):
+        return self.raw(row).decode('utf-8')
+
+    def __len__(self):
+        return self.row_count
+
+    def close(self):
+        if self._offsets is not None:
+            self._offsets.release()
+        for mapped in (self._data, self._index):
+            if mapped is not None:
+                mapped.close()
+        self._data_file.close()
+        self._index_file.close()
+
+
+class LeadSnapshot:
+    """Append-only, memory-mapped columnar copy of a sheet tab"""
+
+    def __init__(self, directory=SNAPSHOT_DIR, num_columns=SNAPSHOT_COLUMNS):
+        self.directory = directory
+        self.num_columns = num_columns
+        self.row_count = 0
+        self.sheet_id = None
+        self.sheet_name = None
+        self._columns = []
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _column_paths(self, index):
+        return self._path(f'col_{index:02d}.dat'), self._path(f'col_{index:02d}.idx')
+
+    def open(self, sheet_id=None, sheet_name=None):
+        """Load the snapshot from disk, resetting it if it belongs to another sheet"""
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {}
+        if os.path.exists(self._path(META_FILE)):
+            with open(self._path(META_FILE)) as meta_file:
+                meta = json.load(meta_file)
+
+        if sheet_id is None:
+            sheet_id, sheet_name = meta.get('sheet_id'), meta.get('sheet_name')
+
+        if meta.get('sheet_id') != sheet_id or meta.get('sheet_name') != sheet_name \
+                or meta.get('columns') != self.num_columns:
+            self.sheet_id, self.sheet_name = sheet_id, sheet_name
+            self.reset()
+            return self
+
+        self.sheet_id, self.sheet_name = sheet_id, sheet_name
+        self.row_count = meta.get('rows', 0)
+        self._truncate_to_meta()
+        self._map_columns()
+        return self
+
+    def open_read_only(self):
+        """Map the committed rows without repairing or resetting anything, for readers in other processes"""
+        with open(self._path(META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        self.sheet_id, self.sheet_name = meta.get('sheet_id'), meta.get('sheet_name')
+        self.num_columns = meta.get('columns', self.num_columns)
+        self.row_count = meta.get('rows', 0)
+        self._map_columns()
+        return self
+
+    def _truncate_to_meta(self):
+        """Drop bytes written after the last committed row (e.g. after a crash mid-append)"""
+        for index in range(self.num_columns):
+            data_path, index_path = self._column_paths(index)
+            for path in (data_path, index_path):
+                if not os.path.exists(path):
+                    open(path, 'wb').close()
+
+            with open(index_path, 'r+b') as index_file:
+                index_file.truncate(self.row_count * OFFSET_SIZE)
+                end = 0
+                if self.row_count:
+                    index_file.seek((self.row_count - 1) * OFFSET_SIZE)
+                    end = array('Q', index_file.read(OFFSET_SIZE))[0]
+            with open(data_path, 'r+b') as data_file:
+                data_file.truncate(end)
+
+    def _map_columns(self):
+        self._unmap_columns()
+        self._columns = [
+            _Column(*self._column_paths(index), self.row_count)
+            for index in range(self.num_columns)
+        ]
+
+    def _unmap_columns(self):
+        for column in self._columns:
+            column.close()
+        self._columns = []
+
+    def _write_meta(self):
+        meta = {
+            'sheet_id': self.sheet_id,
+            'sheet_name': self.sheet_name,
+            'columns': self.num_columns,
+            'rows': self.row_count,
+        }
+        tmp_path = self._path(META_FILE + '.tmp')
+        with open(tmp_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_path, self._path(META_FILE))
+
+    def reset(self):
+        """Discard all stored rows"""
+        self._unmap_columns()
+        os.makedirs(self.directory, exist_ok=True)
+        for index in range(self.num_columns):
+            for path in self._column_paths(index):
+                open(path, 'wb').close()
+        self.row_count = 0
+        self._write_meta()
+        self._map_columns()
+
+    def truncate(self, row_count):
+        """Drop the rows from row_count on, e.g. rows that have to be fetched and processed again"""
+        if row_count >= self.row_count:
+            return
+        self._unmap_columns()
+        self.row_count = row_count
+        self._write_meta()
+        self._truncate_to_meta()
+        self._map_columns()
+
+    def append_rows(self, rows):
+        """Append sheet rows (lists of cell strings) to the end of the snapshot"""
+        if not rows:
+            return 0
+
+        self._unmap_columns()
+        for index in range(self.num_columns):
+            data_path, index_path = self._column_paths(index)
+            with open(data_path, 'ab') as data_file:
+                end = data_file.tell()
+                offsets = array('Q')
+                chunks = []
+                for row in rows:
+                    if index < len(row) and row[index] not in (None, ""):
+                        encoded = str(row[index]).encode('utf-8')
+                        chunks.append(encoded)
+                        end += len(encoded)
+                    offsets.append(end)
+                data_file.write(b"".join(chunks))
+            with open(index_path, 'ab') as index_file:
+                offsets.tofile(index_file)
+
+        # The meta file is the commit point: rows only become visible once it is written
+        self.row_count += len(rows)
+        self._write_meta()
+        self._map_columns()
+        return len(rows)
+
+    def column(self, index):
+        return self._columns[index]
+
+    def row(self, row, columns=None):
+        """Return one row as a list, trimmed of trailing empty cells like the Sheets API"""
+        indexes = range(self.num_columns) if columns is None else columns
+        values = [self._columns[index][row] for index in indexes]
+        if columns is None:
+            while values and values[-1] == "":
+                values.pop()
+        return values
+
+    def rows(self, start=0, columns=None):
+        """Iterate over stored rows starting at a zero-based row index"""
+        for row in range(start, self.row_count):
+            yield self.row(row, columns)
+
+    def header(self):
+        return self.row(0) if self.row_count else []
+
+    def resolve_column(self, name):
+        """Resolve a column reference given as a header name, an A1 letter or a zero-based index"""
+        if name.isdigit():
+            return int(name)
+        lowered = name.strip().lower()
+        for index, title in enumerate(self.header()):
+            if title.strip().lower() == lowered:
+                return index
+        for index in range(self.num_columns):
+            if column_letter(index) == name.strip().upper():
+                return index
+        raise ValueError(f"Unknown column '{name}'")
+
+    def query(self, where=None, columns=None, limit=None, include_header=False):
+        """
+        Filter and project stored rows.
+
+        where is a list of (column_index, operator, value) tuples, where operator
+        is '=', '!=' or '~' (case-insensitive substring). Rows are yielded as
+        (row_index, values) pairs.
+        """
+        where = where or []
+        start = 0 if include_header else 1
+        # Equality is checked on the raw mapped bytes so non-matching rows are never decoded
+        encoded_filters = [
+            (self._columns[index], operator, value.encode('utf-8') if operator != '~' else value.lower())
+            for index, operator, value in where
+        ]
+        found = 0
+        for row in range(start, self.row_count):
+            matched = True
+            for column, operator, value in encoded_filters:
+                if operator == '=':
+                    matched = column.raw(row) == value
+                elif operator == '!=':
+                    matched = column.raw(row) != value
+                else:
+                    matched = value in column[row].lower()
+                if not matched:
+                    break
+            if not matched:
+                continue
+
+            yield row, self.row(row, columns)
+            found += 1
+            if limit and found >= limit:
+                return
+
+    def close(self):
+        self._unmap_columns()
+
+
+def _parse_filter(snapshot, expression):
+    for operator in ('!=', '=', '~'):
+        if operator in expression:
+            name, value = expression.split(operator, 1)
+            return snapshot.resolve_column(name), operator, value
+    raise ValueError(f"Invalid filter '{expression}', expected COLUMN=VALUE, COLUMN!=VALUE or COLUMN~TEXT")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the local leads snapshot without calling the Sheets API")
+    parser.add_argument('--dir', default=SNAPSHOT_DIR, help="Snapshot directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('info', help="Show snapshot metadata and columns")
+
+    query_parser = subparsers.add_parser('query', help="Filter and project stored leads")
+    query_parser.add_argument('--where', action='append', default=[],
+                              help="Filter such as 'Platform=fb', 'Status!=done' or 'Name~tan' (repeatable)")
+    query_parser.add_argument('--columns', help="Comma-separated columns to output (names, letters or indexes)")
+    query_parser.add_argument('--limit', type=int, help="Maximum number of rows to output")
+    query_parser.add_argument('--count', action='store_true', help="Only print the number of matching rows")
+    query_parser.add_argument('--format', choices=['tsv', 'csv', 'json'], default='tsv')
+
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(os.path.join(args.dir, META_FILE)):
+        print(f"❌ No snapshot found in '{args.dir}'. Run the monitor first.")
+        return 1
+
+    snapshot = LeadSnapshot(args.dir).open()
+    try:
+        if args.command == 'info':
+            print(f"Sheet: {snapshot.sheet_id} / {snapshot.sheet_name}")
+            print(f"Rows (including header): {snapshot.row_count}")
+            for index, title in enumerate(snapshot.header()):
+                print(f"  {column_letter(index)} [{index}] {title}")
+            return 0
+
+        where = [_parse_filter(snapshot, expression) for expression in args.where]
+        header = snapshot.header()
+        columns = list(range(len(header)))
+        if args.columns:
+            columns = [snapshot.resolve_column(name) for name in args.columns.split(',')]
+
+        results = snapshot.query(where=where, columns=columns, limit=args.limit)
+        if args.count:
+            print(sum(1 for _ in results))
+            return 0
+
+        titles = ['Row'] + [
+            header[index] if index < len(header) else column_letter(index)
+            for index in columns
+        ]
+        if args.format == 'json':
+            for row, values in results:
+                print(json.dumps(dict(zip(titles, [row + 1] + values)), ensure_ascii=False))
+        else:
+            writer = csv.writer(sys.stdout, delimiter='\t' if args.format == 'tsv' else ',')
+            writer.writerow(titles)
+            for row, values in results:
+                writer.writerow([row + 1] + values)
+        return 0
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        snapshot.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,96 +1,350 @@
 import asyncio
+import base64
+import functools
+import json
+import multiprocessing
+import os
 import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from google_sheets_service import GoogleSheetsService
 from telegram_service import TelegramService
-from config import GOOGLE_SHEET_ID, GOOGLE_SHEET_TAB, CHECK_INTERVAL_MINUTES
+from lead_snapshot import LeadSnapshot
+from pipeline import Pipeline, Stage
+from lead_router import LeadRouter
+from circuit_breaker import ServiceError
+from traffic_trace import trace_event
+from lead_enrichment import CampaignDirectory, enrich_lead, enrichment_stats
+from lead_fingerprints import (
+    KEY_COLUMNS, lead_id_for_row, lead_fingerprint, contact_fingerprints, fingerprint_rows, fingerprint_snapshot_rows
+)
+from lead_schema import (
+    FIELD_MAPPING, KEY_FIELDS, ADDITIONAL_FIELDS, RENDERED_LAST_COLUMN, SUBMISSION_DATE_COLUMN,
+    column_letter, parse_submission_date
+)
+from config import (
+    GOOGLE_SHEET_ID, GOOGLE_SHEET_TAB, CHECK_INTERVAL_MINUTES, SNAPSHOT_ENABLED, SNAPSHOT_DIR, SNAPSHOT_VERIFY_ROWS,
+    INITIAL_LOAD_WINDOW_ROWS, INITIAL_LOAD_PREFETCH, SHEET_LAST_COLUMN, RESYNC_WORKERS, RESYNC_PARALLEL_MIN_ROWS,
+    PIPELINE_QUEUE_SIZE, PIPELINE_CONCURRENCY, SEND_DELAY_SECONDS,
+    ROUTING_RULES_FILE, PRIORITY_AGEING_SECONDS, ENRICHMENT_ENABLED, CAMPAIGN_LOOKUP_TAB, REPEAT_LEAD_ACTION,
+    WRITEBACK_ENABLED, WRITEBACK_COLUMN,
+    CONFIG_FILE, STATE_FILE, CHECKPOINT_MAX_AGE_HOURS, SHUTDOWN_DRAIN_SECONDS, load_runtime_settings
+)
+
+WRITEBACK_HEADER = "Notified at"
+# The poller moves the row cursor and the deduper updates the dedup sets across awaits, so a
+# second worker in either would fetch rows twice or let duplicates through
+SERIAL_STAGES = ('poller', 'deduper')
+
 
 class LeadsMonitor:
-    def __init__(self):
-        self.sheets_service = GoogleSheetsService()
-        self.telegram_service = TelegramService()
+    def __init__(self, sheets_service=None, telegram_service=None, tenant=None, sheets_executor=None,
+                 writeback_service=None):
+        """
+        tenant overrides the sheet, interval, routing rules and file locations for one clinic
+        (see tenant_registry.py); without it the settings come from the environment.
+        """
+        tenant = tenant or {}
+        self.sheets_service = sheets_service or GoogleSheetsService()
+        self.telegram_service = telegram_service or TelegramService()
+        self.writeback = tenant.get('writeback', WRITEBACK_ENABLED)
+        self.writeback_column = tenant.get('writeback_column', WRITEBACK_COLUMN)
+        if self.writeback and writeback_service is None:
+            writeback_service = GoogleSheetsService.for_writes()
+        self.writeback_service = writeback_service
+        self.sheets_executor = sheets_executor  # None runs polls on asyncio's default executor
+        self.name = tenant.get('name', '')
+        self.sheet_id = tenant.get('sheet_id', GOOGLE_SHEET_ID)
+        self.sheet_tab = tenant.get('sheet_tab', GOOGLE_SHEET_TAB)
+        self.check_interval_minutes = tenant.get('check_interval_minutes', CHECK_INTERVAL_MINUTES)
+        self.routing_rules_file = tenant.get('routing_rules_file', ROUTING_RULES_FILE)
+        self.state_file = tenant.get('state_file', STATE_FILE)
         self.last_row_count = 0
         self.initialized = False
-        self.processed_leads = set()  # Track processed leads to avoid duplicates
+        self.processed_leads = set()  # Fingerprints of processed leads, to avoid duplicates
+        self.contact_index = set()  # Fingerprints of every normalized email and phone seen, to spot repeat leads
+        self.snapshot = LeadSnapshot(tenant.get('snapshot_dir', SNAPSHOT_DIR)) if SNAPSHOT_ENABLED else None
+        self.last_column = SHEET_LAST_COLUMN or RENDERED_LAST_COLUMN  # Columns past this are never requested
+        self.pipeline = None
+        self.router = None
+        self.load_routing_rules()
+        self.enrichment = tenant.get('enrichment', ENRICHMENT_ENABLED)
+        lookup_tab = tenant.get('campaign_lookup_tab', CAMPAIGN_LOOKUP_TAB)
+        self.campaigns = (CampaignDirectory(self.sheets_service, self.sheet_id, lookup_tab)
+                          if self.enrichment and lookup_tab else None)
+        self._campaign_refresh = None  # Future of the lookup tab read in progress
+        self.started_at = time.time()
+        self.last_poll_ok_at = None  # time.time() of the last successful poll / delivery, for health checks
+        self.last_delivery_ok_at = None
+        self.polls = 0
+        self.poll_errors = 0
+        self.leads_sent = 0
+        self.leads_failed = 0
+        self.delivery_latency = {}  # Priority -> [delivered, total seconds, max seconds] from poll to delivery
+        self.writeback_rows = 0
+        self.writeback_errors = 0
+        self._pending_writeback = {}  # Row number -> "Notified at" value, flushed once per cycle
+        self._writeback_header_written = False
+        self._wake = asyncio.Event()  # Interrupts the sleep between cycles
+        self._stopping = False
+        self._reload_requested = False
+        self._state_dirty = False
+        self._checkpoint_saved_at = 0.0  # time.time() of the checkpoint on disk
+        self._config_mtime = self._get_config_mtime()
     
     def get_lead_id(self, row):
         """Generate a unique ID for a lead based on name, email, and date"""
-        if len(row) < 4:
+        return lead_id_for_row(row)
+    
+    def get_lead_fingerprint(self, row):
+        """Return a compact 64-bit fingerprint of the lead ID, used as the dedup key"""
+        lead_id = self.get_lead_id(row)
+        if not lead_id:
             return None
-        
-        name = row[2] if len(row) > 2 else ""
-        email = row[3] if len(row) > 3 else ""
-        date = row[1] if len(row) > 1 else ""
-        
-        # Create a unique identifier
-        return f"{name}_{email}_{date}".strip()
+        return lead_fingerprint(lead_id)
     
     async def initialize(self):
         """Initialize the monitor by getting the current row count"""
         try:
-            self.last_row_count = self.sheets_service.get_last_row_count(GOOGLE_SHEET_ID, GOOGLE_SHEET_TAB)
+            known_rows = 0
+            if self.snapshot:
+                self.snapshot.open(self.sheet_id, self.sheet_tab)
+                await self._run_sheets_work(self._verify_snapshot)
+                known_rows = self.snapshot.row_count
+            
+            if self.load_checkpoint():
+                print(f"Restored checkpoint: {self.last_row_count} rows, "
+                      f"{len(self.processed_leads)} processed leads")
+                if self.snapshot:
+                    await self._run_sheets_work(self._sync_snapshot_to_cursor)
+                self.initialized = True
+                trace_event('initialized', sheet_id=self.sheet_id, sheet_tab=self.sheet_tab, rows=self.last_row_count)
+                return
             
-            # Load existing leads into processed set to avoid duplicate notifications
-            all_data = self.sheets_service.get_sheet_data(GOOGLE_SHEET_ID, GOOGLE_SHEET_TAB)
-            for row in all_data[1:]:  # Skip header row
-                lead_id = self.get_lead_id(row)
-                if lead_id:
-                    self.processed_leads.add(lead_id)
+            self.last_row_count = await self._run_sheets_work(
+                self.sheets_service.get_last_row_count, self.sheet_id, self.sheet_tab, known_rows=known_rows
+            )
+            if self.writeback:
+                await self._run_sheets_work(self._rewind_to_last_notified_row)
+            
+            # Load existing leads into processed set to avoid duplicate notifications. The
+            # windows may wait for Sheets quota, so the load runs off the event loop.
+            started = time.perf_counter()
+            await self._run_sheets_work(self._load_processed_leads)
+            elapsed = time.perf_counter() - started
             
             print(f"Initialized with {self.last_row_count} rows in sheet")
-            print(f"Loaded {len(self.processed_leads)} existing leads into memory")
+            print(f"Loaded {len(self.processed_leads)} existing leads into memory "
+                  f"in {elapsed:.2f}s ({self.last_row_count / max(elapsed, 1e-9):.0f} rows/s)")
             self.initialized = True
+            trace_event('initialized', sheet_id=self.sheet_id, sheet_tab=self.sheet_tab, rows=self.last_row_count)
         except Exception as e:
             print(f"Error initializing monitor: {e}")
             self.initialized = False
     
+    async def _run_sheets_work(self, func, *args, **kwargs):
+        """
+        Run blocking Sheets work on the sheets executor, which tenants share with their polls
+        so initial loads are scheduled fairly with everything else
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.sheets_executor, functools.partial(func, *args, **kwargs))
+    
+    def _verify_snapshot(self):
+        """
+        The row count alone misses edits, sorts and a delete plus insert: compare the key
+        columns of the snapshot's last SNAPSHOT_VERIFY_ROWS rows with the sheet, and start the
+        snapshot over when they differ.
+        """
+        stored_rows = self.snapshot.row_count
+        if not stored_rows or not SNAPSHOT_VERIFY_ROWS:
+            return
+        first_row = max(1, stored_rows - SNAPSHOT_VERIFY_ROWS + 1)
+        columns = range(max(KEY_COLUMNS) + 1)
+        try:
+            sheet_rows = self.sheets_service.get_sheet_data(
+                self.sheet_id, self.sheet_tab, f'A{first_row}:{column_letter(columns[-1])}{stored_rows}'
+            )
+        except ServiceError as e:
+            print(f"Could not verify the local snapshot, using it as is: {e}")
+            return
+        
+        def cells(row):
+            row = [str(value) for value in row]
+            while row and row[-1] == "":
+                row.pop()
+            return row
+        
+        # Trailing blank rows are trimmed by the API
+        sheet_rows = list(sheet_rows) + [[]] * (stored_rows - first_row + 1 - len(sheet_rows))
+        for offset, sheet_row in enumerate(sheet_rows):
+            if cells(sheet_row) != cells(self.snapshot.row(first_row - 1 + offset, columns)):
+                print(f"Snapshot row {first_row + offset} no longer matches the sheet, rebuilding it")
+                self.snapshot.reset()
+                return
+    
+    def _sync_snapshot_to_cursor(self):
+        """
+        Make a restored snapshot end at the checkpoint's cursor, otherwise polls would never
+        append to it again: rows past the cursor are dropped, missing ones are fetched.
+        """
+        stored_rows = self.snapshot.row_count
+        if stored_rows > self.last_row_count:
+            print(f"Snapshot has {stored_rows - self.last_row_count} row(s) past the checkpoint, dropping them")
+            self.snapshot.truncate(self.last_row_count)
+        elif stored_rows < self.last_row_count:
+            print(f"Snapshot is {self.last_row_count - stored_rows} row(s) behind the checkpoint, fetching them")
+            try:
+                for _ in self._iter_sheet_windows(stored_rows + 1, self.last_row_count):
+                    pass
+            except ServiceError as e:
+                # Polls skip the snapshot until it is back in step; the next start tries again
+                print(f"Could not catch the snapshot up, it stays at row {self.snapshot.row_count}: {e}")
+    
+    def _rewind_to_last_notified_row(self):
+        """
+        Cold start with write-back: only rows up to the last one marked "Notified at" are
+        history, rows after it arrived while the bot was down and are left for the next poll.
+        A sheet without any marks yet (write-back just enabled) is all history, as before.
+        """
+        if self.last_row_count < 2:
+            return
+        column = self.writeback_column
+        marks = self.sheets_service.get_sheet_data(
+            self.sheet_id, self.sheet_tab, f'{column}2:{column}{self.last_row_count}',
+            major_dimension='COLUMNS', value_render_option='UNFORMATTED_VALUE'
+        )
+        if not marks:
+            return
+        # Trailing empty cells are trimmed, so the column ends at the last marked row
+        last_notified_row = 1 + len(marks[0])
+        if last_notified_row >= self.last_row_count:
+            return
+        print(f"{self.last_row_count - last_notified_row} row(s) after row {last_notified_row}, "
+              f"the last one marked notified, will be checked as new leads")
+        self.last_row_count = last_notified_row
+        if self.snapshot:
+            self.snapshot.truncate(last_notified_row)
+    
+    def _load_processed_leads(self):
+        if RESYNC_WORKERS and self.last_row_count >= RESYNC_PARALLEL_MIN_ROWS:
+            self._load_processed_leads_parallel()
+            return
+        for row in self._iter_existing_rows():
+            fingerprint = self.get_lead_fingerprint(row)
+            if fingerprint is not None:
+                self.processed_leads.add(fingerprint)
+            self.contact_index.update(fingerprint for _, fingerprint in contact_fingerprints(row))
+    
+    def _load_processed_leads_parallel(self):
+        """Fingerprint the existing rows in worker processes while the next windows download"""
+        # forkserver/spawn: forking this process would copy the locks held by its other threads
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        with ProcessPoolExecutor(max_workers=RESYNC_WORKERS, mp_context=context) as pool:
+            futures = [pool.submit(*task) for task in self._iter_resync_tasks()]
+            for future in futures:
+                packed_leads, packed_contacts = future.result()
+                for packed, index in ((packed_leads, self.processed_leads), (packed_contacts, self.contact_index)):
+                    fingerprints = array('Q')
+                    fingerprints.frombytes(packed)
+                    index.update(fingerprints)
+    
+    def _iter_resync_tasks(self):
+        """
+        Yield (function, *args) fingerprinting jobs covering every existing data row.
+        
+        Rows already in the snapshot are sent as row ranges that the worker reads from the
+        memory-mapped files; only rows the snapshot couldn't store are sent themselves.
+        """
+        snapshot_rows = 0
+        if self.snapshot:
+            snapshot_rows = self.snapshot.row_count
+            if snapshot_rows > self.last_row_count:
+                print(f"Sheet has fewer rows ({self.last_row_count}) than the snapshot "
+                      f"({snapshot_rows}), rebuilding it")
+                self.snapshot.reset()
+                snapshot_rows = 0
+            elif snapshot_rows:
+                print(f"Loaded {snapshot_rows} rows from local snapshot")
+                # Enough chunks to keep every worker busy, few enough that opening the maps is cheap
+                chunk = max(INITIAL_LOAD_WINDOW_ROWS, snapshot_rows // (RESYNC_WORKERS * 4))
+                for start in range(1, snapshot_rows, chunk):
+                    yield fingerprint_snapshot_rows, self.snapshot.directory, start, min(start + chunk, snapshot_rows)
+        
+        for rows in self._iter_sheet_windows(snapshot_rows + 1, self.last_row_count):
+            stored_rows = self.snapshot.row_count if self.snapshot else 0
+            if stored_rows > snapshot_rows:
+                yield fingerprint_snapshot_rows, self.snapshot.directory, max(snapshot_rows, 1), stored_rows
+                snapshot_rows = stored_rows
+            else:
+                yield fingerprint_rows, [row[:5] for row in rows]
+    
+    def _iter_existing_rows(self):
+        """Yield the existing data rows (without header), reusing the local snapshot when possible"""
+        first_row = 1
+        if self.snapshot:
+            stored_rows = self.snapshot.row_count
+            
+            if 0 < stored_rows <= self.last_row_count:
+                # Only rows added since the snapshot was last written need to come from the API
+                print(f"Loaded {stored_rows} rows from local snapshot")
+                yield from self.snapshot.rows(start=1)
+                first_row = stored_rows + 1
+            elif stored_rows:
+                print(f"Sheet has fewer rows ({self.last_row_count}) than the snapshot ({stored_rows}), rebuilding it")
+                self.snapshot.reset()
+        
+        for rows in self._iter_sheet_windows(first_row, self.last_row_count):
+            yield from rows
+    
+    def _iter_sheet_windows(self, first_row, last_row):
+        """Stream rows first_row..last_row in fixed-size windows, keeping the snapshot in step"""
+        windows = self.sheets_service.iter_sheet_windows(
+            self.sheet_id, self.sheet_tab, INITIAL_LOAD_WINDOW_ROWS,
+            start_row=first_row, end_row=last_row, last_column=self.last_column,
+            prefetch=INITIAL_LOAD_PREFETCH
+        )
+        for window_start, rows in windows:
+            window_end = min(window_start + INITIAL_LOAD_WINDOW_ROWS - 1, last_row)
+            self._append_to_snapshot(rows, window_end - window_start + 1)
+            if window_start == 1:
+                rows = rows[1:]  # Skip header row
+            yield rows
+    
+    def _append_to_snapshot(self, rows, expected_count):
+        """Append fetched rows to the snapshot, padding blank rows trimmed by the API"""
+        if not self.snapshot:
+            return
+        try:
+            rows = list(rows[:expected_count]) + [[]] * (expected_count - len(rows))
+            self.snapshot.append_rows(rows)
+        except Exception as e:
+            print(f"Error writing local snapshot: {e}")
+    
     def format_lead_notification(self, new_rows):
         """Format the notification message for new leads"""
         if not new_rows:
             return ""
         
-        message = f"🆕 New Lead(s) Added to {GOOGLE_SHEET_TAB.title()} Sheet!\n\n"
+        message = f"🆕 New Lead(s) Added to {self.sheet_tab.title()} Sheet!\n\n"
         
         for i, row in enumerate(new_rows, 1):
             message += f"📋 Lead #{i}:\n"
             message += "=" * 30 + "\n"
             
-            # Map actual columns from your Google Sheet
-            field_mapping = {
-                0: "📝 Form Type",
-                1: "📅 Submission Date", 
-                2: "👤 Name",
-                3: "📧 Email",
-                4: "📱 Phone",
-                5: "🌐 Platform",
-                6: "📢 Campaign Name",
-                7: "🎯 Adset Name",
-                8: "📺 Ad Name",
-                9: "💪 Underarm Concerns",
-                10: "👁️ Eye Area Concerns",
-                11: "⏰ Duration of Concern",
-                12: "📅 Preferred Appointment Time",
-                13: "📞 Contact Preference",
-                14: "📊 Status"
-            }
-            
-            # Display key information first
-            key_fields = [2, 3, 4, 1, 5, 14]  # Name, Email, Phone, Date, Platform, Status
-            
-            for j in key_fields:
+            for j in KEY_FIELDS:
                 if j < len(row) and row[j] and str(row[j]).strip():
-                    field_name = field_mapping.get(j, f"Field {j+1}")
+                    field_name = FIELD_MAPPING.get(j, f"Field {j+1}")
                     message += f"{field_name}: {row[j]}\n"
             
             message += "\n📋 Additional Details:\n"
             message += "-" * 20 + "\n"
             
-            # Display additional details
-            additional_fields = [0, 6, 7, 8, 9, 10, 11, 12, 13]
-            
-            for j in additional_fields:
+            for j in ADDITIONAL_FIELDS:
                 if j < len(row) and row[j] and str(row[j]).strip():
-                    field_name = field_mapping.get(j, f"Field {j+1}")
+                    field_name = FIELD_MAPPING.get(j, f"Field {j+1}")
                     # Truncate very long fields
                     value = str(row[j])
                     if len(value) > 100:
@@ -104,51 +358,28 @@ class LeadsMonitor:
         
         return message
     
-    def format_single_lead_notification(self, row, lead_number):
-        """Format notification for a single lead"""
+    def format_single_lead_notification(self, row, lead_number, total_rows=None, enrichment=()):
+        """Format notification for a single lead, with enrichment's (label, value) lines after the key fields"""
         if not row:
             return ""
         
-        message = f"🆕 New Lead #{lead_number} Added to {GOOGLE_SHEET_TAB.title()} Sheet!\n\n"
+        message = f"🆕 New Lead #{lead_number} Added to {self.sheet_tab.title()} Sheet!\n\n"
         message += "📋 Lead Details:\n"
         message += "=" * 30 + "\n"
         
-        # Map actual columns from your Google Sheet
-        field_mapping = {
-            0: "📝 Form Type",
-            1: "📅 Submission Date", 
-            2: "👤 Name",
-            3: "📧 Email",
-            4: "📱 Phone",
-            5: "🌐 Platform",
-            6: "📢 Campaign Name",
-            7: "🎯 Adset Name",
-            8: "📺 Ad Name",
-            9: "💪 Underarm Concerns",
-            10: "👁️ Eye Area Concerns",
-            11: "⏰ Duration of Concern",
-            12: "📅 Preferred Appointment Time",
-            13: "📞 Contact Preference",
-            14: "📊 Status"
-        }
-        
-        # Display key information first
-        key_fields = [2, 3, 4, 1, 5, 14]  # Name, Email, Phone, Date, Platform, Status
-        
-        for j in key_fields:
+        for j in KEY_FIELDS:
             if j < len(row) and row[j] and str(row[j]).strip():
-                field_name = field_mapping.get(j, f"Field {j+1}")
+                field_name = FIELD_MAPPING.get(j, f"Field {j+1}")
                 message += f"{field_name}: {row[j]}\n"
+        for label, value in enrichment:
+            message += f"{label}: {value}\n"
         
         message += "\n📋 Additional Details:\n"
         message += "-" * 20 + "\n"
         
-        # Display additional details
-        additional_fields = [0, 6, 7, 8, 9, 10, 11, 12, 13]
-        
-        for j in additional_fields:
+        for j in ADDITIONAL_FIELDS:
             if j < len(row) and row[j] and str(row[j]).strip():
-                field_name = field_mapping.get(j, f"Field {j+1}")
+                field_name = FIELD_MAPPING.get(j, f"Field {j+1}")
                 # Truncate very long fields
                 value = str(row[j])
                 if len(value) > 100:
@@ -156,7 +387,9 @@ class LeadsMonitor:
                 message += f"{field_name}: {value}\n"
         
         message += "\n" + "=" * 40 + "\n"
-        message += f"📊 Total leads in sheet: {self.last_row_count + lead_number}\n"
+        if total_rows is None:
+            total_rows = self.last_row_count + lead_number
+        message += f"📊 Total leads in sheet: {total_rows}\n"
         message += f"⏰ Received at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         
         return message
@@ -168,11 +401,10 @@ class LeadsMonitor:
         
         try:
             # Get the submission date (column 1)
-            submission_date_str = row[1]
+            submission_date_str = row[SUBMISSION_DATE_COLUMN]
             
             # Parse the date (format: "October 16 2025 14:00:15")
-            from datetime import datetime
-            submission_date = datetime.strptime(submission_date_str, "%B %d %Y %H:%M:%S")
+            submission_date = parse_submission_date(submission_date_str)
             
             # Check if it's from October 16, 2025 onwards
             cutoff_date = datetime(2025, 10, 16, 0, 0, 0)
@@ -182,68 +414,454 @@ class LeadsMonitor:
             print(f"Error parsing date '{row[1] if len(row) > 1 else 'N/A'}': {e}")
             return False
     
+    def build_pipeline(self):
+        """Wire the poll -> parse -> dedup -> (enrich ->) render -> send stages together"""
+        def stage(name, handler, queue_size=PIPELINE_QUEUE_SIZE, priority=None):
+            concurrency = PIPELINE_CONCURRENCY.get(name, 1)
+            if name in SERIAL_STAGES and concurrency > 1:
+                print(f"Ignoring PIPELINE_CONCURRENCY {name}={concurrency}: the {name} stage must run alone")
+                concurrency = 1
+            return Stage(name, handler, concurrency, queue_size, priority)
+        
+        return Pipeline([
+            stage('poller', self._poll_stage, queue_size=1),  # At most one poll waiting
+            stage('parser', self._parse_stage),
+            stage('deduper', self._dedup_stage),
+        ] + ([stage('enricher', self._enrich_stage)] if self.enrichment else []) + [
+            stage('renderer', self._render_stage),
+            # Sending is the rate-limited step, so that's where urgent leads move up the queue
+            stage('sender', self._send_stage, priority=self._send_order),
+        ] + ([stage('writeback', self._writeback_stage)] if self.writeback else []))
+    
+    async def start_pipeline(self):
+        if self.pipeline is None:
+            self.pipeline = self.build_pipeline()
+        await self.pipeline.start()
+    
+    def _fetch_new_rows(self):
+        """Blocking Sheets calls for one poll, run off the event loop"""
+        current_row_count = self.sheets_service.get_last_row_count(
+            self.sheet_id, self.sheet_tab, known_rows=self.last_row_count
+        )
+        if current_row_count <= self.last_row_count:
+            return current_row_count, []
+        
+        # Get only the new rows
+        new_rows = self.sheets_service.get_sheet_data(
+            self.sheet_id, self.sheet_tab,
+            f'A{self.last_row_count + 1}:{self.last_column}{current_row_count}'
+        )
+        return current_row_count, new_rows
+    
+    async def _poll_stage(self, _tick):
+        trace_event('poll', sheet_id=self.sheet_id, sheet_tab=self.sheet_tab, rows=self.last_row_count)
+        if self._pending_writeback:
+            await self.flush_writeback()
+        await self.refresh_campaigns()
+        loop = asyncio.get_running_loop()
+        try:
+            current_row_count, new_rows = await loop.run_in_executor(self.sheets_executor, self._fetch_new_rows)
+        except ServiceError as e:
+            # Degraded mode: keep the cursor where it is and try again next cycle
+            self.poll_errors += 1
+            print(f"Skipping poll, cursor stays at row {self.last_row_count}: {e}")
+            return None
+        self.polls += 1
+        self.last_poll_ok_at = time.time()
+        
+        if current_row_count > self.last_row_count:
+            new_row_count = current_row_count - self.last_row_count
+            print(f"Found {new_row_count} new row(s)!")
+            
+            if self.snapshot and self.snapshot.row_count == self.last_row_count:
+                self._append_to_snapshot(new_rows, new_row_count)
+            
+            first_row_number = self.last_row_count + 1
+            # Update the row count
+            self.last_row_count = current_row_count
+            self._state_dirty = True
+            polled_at = time.monotonic()
+            return [
+                {'row': row, 'row_number': first_row_number + i, 'lead_number': i + 1, 'polled_at': polled_at}
+                for i, row in enumerate(new_rows)
+            ]
+        
+        if current_row_count < self.last_row_count:
+            print(f"Row count decreased from {self.last_row_count} to {current_row_count}")
+            self.last_row_count = current_row_count
+            self._state_dirty = True
+            if self.snapshot:
+                # Rows were removed or reordered, the snapshot is rebuilt on the next initialization
+                self.snapshot.reset()
+        return None
+    
+    async def _parse_stage(self, lead):
+        # Filter for new leads from October 16, 2025 onwards
+        return [lead] if self.is_new_lead(lead['row']) else None
+    
+    async def _dedup_stage(self, lead):
+        fingerprint = self.get_lead_fingerprint(lead['row'])
+        if fingerprint is None or fingerprint in self.processed_leads:
+            return None
+        self.processed_leads.add(fingerprint)  # Mark as processed
+        self._state_dirty = True
+        
+        # Blocking index: the same person resubmitting shares a normalized email or phone
+        contacts = contact_fingerprints(lead['row'])
+        repeated = [field for field, contact in contacts if contact in self.contact_index]
+        self.contact_index.update(contact for _, contact in contacts)
+        if repeated and REPEAT_LEAD_ACTION == 'suppress':
+            print(f"Suppressing repeat lead {lead['lead_number']} (same {' and '.join(repeated)})")
+            return None
+        if repeated and REPEAT_LEAD_ACTION == 'tag':
+            lead['repeat_of'] = repeated
+        return [lead]
+    
+    async def refresh_campaigns(self):
+        """
+        Re-read the campaign lookup tab when it is due. Only the first read is waited for, so
+        the first leads already get their campaign metadata; later ones run in the background.
+        """
+        if self.campaigns is None or not self.campaigns.is_due():
+            return
+        if self._campaign_refresh and not self._campaign_refresh.done():
+            return
+        loop = asyncio.get_running_loop()
+        self._campaign_refresh = loop.run_in_executor(self.sheets_executor, self.campaigns.refresh)
+        if self.campaigns.loaded_at is None:
+            await self._campaign_refresh
+    
+    async def _enrich_stage(self, lead):
+        # Joins in-memory tables only: a cached phone parse and the campaign lookup
+        lead['enrichment'] = enrich_lead(lead['row'], self.campaigns)
+        return [lead]
+    
+    def load_routing_rules(self):
+        """(Re)compile the routing rules, keeping the current ones if the file is invalid"""
+        if not self.routing_rules_file:
+            return
+        try:
+            self.router = LeadRouter.from_file(self.routing_rules_file)
+            self.telegram_service.routed_chats = self.router.recipients
+            print(f"Loaded {len(self.router.rule_names)} routing rules from {self.routing_rules_file}")
+        except Exception as e:
+            print(f"Error loading routing rules: {e}")
+    
+    def get_recipients(self, row):
+        """Chats that should receive this lead, every allowed user unless routing rules say otherwise"""
+        if self.router is None:
+            return self.telegram_service.allowed_users
+        return self.router.route(row, self.telegram_service.allowed_users)
+    
+    def render_lead(self, lead):
+        """Set a lead's message and priority, the same way for live notifications and backfills"""
+        if self.enrichment and 'enrichment' not in lead:
+            lead['enrichment'] = enrich_lead(lead['row'], self.campaigns)
+        lead['message'] = self.format_single_lead_notification(
+            lead['row'], lead['lead_number'], total_rows=lead['row_number'], enrichment=lead.get('enrichment', ())
+        )
+        if lead['message'] and lead.get('repeat_of'):
+            lead['message'] = (f"🔁 Repeat lead: same {' and '.join(lead['repeat_of'])} as an earlier submission\n\n"
+                               + lead['message'])
+        lead['priority'] = self.router.priority(lead['row']) if self.router else 0
+        return lead
+    
+    async def _render_stage(self, lead):
+        self.render_lead(lead)
+        lead['recipients'] = self.get_recipients(lead['row'])
+        return [lead] if lead['message'] and lead['recipients'] else None
+    
+    @staticmethod
+    def _send_order(lead):
+        """
+        Earliest deadline first: a lead is due PRIORITY_AGEING_SECONDS per priority level after
+        it was polled, so urgent leads go first but a waiting one can't be overtaken forever
+        """
+        return lead['polled_at'] + lead['priority'] * PRIORITY_AGEING_SECONDS
+    
+    async def _send_stage(self, lead):
+        recipients = list(lead['recipients'])
+        breaker = getattr(self.telegram_service, 'breaker', None)
+        failed = []  # Chats the send was attempted for and failed while Telegram was up
+        while recipients:
+            results = await asyncio.gather(*(
+                self.telegram_service.send_notification(user_id, lead['message']) for user_id in recipients
+            ))
+            # None means the breaker refused the send without trying it: those chats are retried
+            # even if the breaker closed meanwhile, e.g. when another chat's half-open probe passed
+            refused = [user_id for user_id, ok in zip(recipients, results) if ok is None]
+            missed = [user_id for user_id, ok in zip(recipients, results) if ok is False]
+            if breaker is not None and breaker.is_open():
+                refused += missed
+            else:
+                failed += missed
+            if not refused:
+                break
+            # Telegram is down: hold this lead, and through backpressure the ones behind it,
+            # until the breaker allows a probe, then retry only the chats that missed it
+            recipients = refused
+            wait = breaker.retry_after() if breaker is not None else 1
+            if wait:
+                print(f"Telegram unavailable, retrying recent lead {lead['lead_number']} in {wait:.0f}s")
+                await asyncio.sleep(wait)
+        
+        success = not failed
+        if success:
+            self.leads_sent += 1
+            self.last_delivery_ok_at = time.time()
+            latency = time.monotonic() - lead['polled_at']
+            stats = self.delivery_latency.setdefault(lead['priority'], [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += latency
+            stats[2] = max(stats[2], latency)
+            print(f"Individual notification sent for recent lead {lead['lead_number']}!")
+        else:
+            self.leads_failed += 1
+            print(f"Failed to send notification for recent lead {lead['lead_number']}")
+        
+        # Small delay between notifications to avoid spam
+        if SEND_DELAY_SECONDS:
+            await asyncio.sleep(SEND_DELAY_SECONDS)
+        return [lead] if success and self.writeback else None
+    
+    async def _writeback_stage(self, lead):
+        # Only collected here; the next poll writes every cell collected since the last one
+        self._pending_writeback[lead['row_number']] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return None
+    
+    async def flush_writeback(self):
+        """Record the collected "Notified at" values in the sheet with one batchUpdate"""
+        pending, self._pending_writeback = self._pending_writeback, {}
+        cells = dict(pending)
+        if not self._writeback_header_written:
+            cells[1] = WRITEBACK_HEADER
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self.sheets_executor, self.writeback_service.write_column_cells,
+                self.sheet_id, self.sheet_tab, self.writeback_column, cells
+            )
+        except ServiceError as e:
+            # Keep them for the next cycle; values collected meanwhile are newer and win
+            self._pending_writeback = {**pending, **self._pending_writeback}
+            self.writeback_errors += 1
+            print(f"Could not record {len(pending)} notification(s) in the sheet, retrying next cycle: {e}")
+            return
+        self._writeback_header_written = True
+        self.writeback_rows += len(pending)
+    
     async def check_for_new_leads(self):
-        """Check for new leads and send notifications"""
+        """Check for new leads and wait until their notifications are sent"""
         if not self.initialized:
             await self.initialize()
             return
         
         try:
-            current_row_count = self.sheets_service.get_last_row_count(GOOGLE_SHEET_ID, GOOGLE_SHEET_TAB)
+            await self.start_pipeline()
+            await self.pipeline.put('poll')
+            await self.pipeline.join()
+        except Exception as e:
+            print(f"Error checking for new leads: {e}")
+    
+    def save_checkpoint(self):
+        """Persist the cursor and dedup set so a restart can skip the cold initialization"""
+        fingerprints = array('Q', self.processed_leads)
+        contacts = array('Q', self.contact_index)
+        saved_at = time.time()
+        state = {
+            'sheet_id': self.sheet_id,
+            'sheet_tab': self.sheet_tab,
+            'last_row_count': self.last_row_count,
+            'saved_at': saved_at,
+            'processed_leads': base64.b64encode(fingerprints.tobytes()).decode('ascii'),
+            'contact_index': base64.b64encode(contacts.tobytes()).decode('ascii'),
+        }
+        try:
+            tmp_path = self.state_file + '.tmp'
+            with open(tmp_path, 'w') as state_file:
+                json.dump(state, state_file)
+            os.replace(tmp_path, self.state_file)
+            self._state_dirty = False
+            self._checkpoint_saved_at = saved_at
+            print(f"Checkpoint saved: {self.last_row_count} rows, {len(fingerprints)} processed leads")
+        except Exception as e:
+            print(f"Error saving checkpoint: {e}")
+    
+    def checkpoint_if_idle(self):
+        """
+        Save state when it changed and nothing is in flight, so the checkpoint is consistent.
+        A quiet sheet changes nothing, so the checkpoint is also re-saved once it is half
+        CHECKPOINT_MAX_AGE_HOURS old, or a restart after a quiet day would ignore it.
+        """
+        if not self.pipeline or not self.pipeline.is_idle():
+            return
+        age_hours = (time.time() - self._checkpoint_saved_at) / 3600
+        if self._state_dirty or age_hours > CHECKPOINT_MAX_AGE_HOURS / 2:
+            self.save_checkpoint()
+    
+    def load_checkpoint(self):
+        """Restore state written by save_checkpoint(), returns False if none is usable"""
+        if not os.path.exists(self.state_file):
+            return False
+        try:
+            with open(self.state_file) as state_file:
+                state = json.load(state_file)
             
-            if current_row_count > self.last_row_count:
-                new_row_count = current_row_count - self.last_row_count
-                print(f"Found {new_row_count} new row(s)!")
-                
-                # Get the new rows
-                all_data = self.sheets_service.get_sheet_data(GOOGLE_SHEET_ID, GOOGLE_SHEET_TAB)
-                
-                # Get only the new rows (skip header if exists)
-                new_rows = all_data[self.last_row_count:]
-                
-                # Filter for new leads from October 16, 2025 onwards that haven't been processed
-                recent_leads = []
-                for row in new_rows:
-                    if self.is_new_lead(row):
-                        lead_id = self.get_lead_id(row)
-                        if lead_id and lead_id not in self.processed_leads:
-                            recent_leads.append(row)
-                            self.processed_leads.add(lead_id)  # Mark as processed
-                
-                if recent_leads:
-                    print(f"Found {len(recent_leads)} NEW leads from October 16, 2025 onwards!")
-                    
-                    # Send individual notification for each recent lead
-                    for i, recent_lead in enumerate(recent_leads, 1):
-                        notification = self.format_single_lead_notification(recent_lead, i)
-                        
-                        if notification:
-                            success = await self.telegram_service.send_notifications_to_all(notification)
-                            if success:
-                                print(f"Individual notification sent for recent lead {i}!")
-                            else:
-                                print(f"Failed to send notification for recent lead {i}")
-                            
-                            # Small delay between notifications to avoid spam
-                            await asyncio.sleep(1)
-                else:
-                    print("No NEW leads from October 16, 2025 onwards found")
-                
-                # Update the row count
-                self.last_row_count = current_row_count
+            if state['sheet_id'] != self.sheet_id or state['sheet_tab'] != self.sheet_tab:
+                print("Checkpoint belongs to another sheet, ignoring it")
+                return False
+            age_hours = (time.time() - state['saved_at']) / 3600
+            if age_hours > CHECKPOINT_MAX_AGE_HOURS:
+                print(f"Checkpoint is {age_hours:.1f} hours old, ignoring it")
+                return False
             
-            elif current_row_count < self.last_row_count:
-                print(f"Row count decreased from {self.last_row_count} to {current_row_count}")
-                self.last_row_count = current_row_count
+            if 'contact_index' not in state:
+                print("Checkpoint has no repeat-lead index, ignoring it")
+                return False
             
+            fingerprints = array('Q')
+            fingerprints.frombytes(base64.b64decode(state['processed_leads']))
+            self.processed_leads = set(fingerprints)
+            contacts = array('Q')
+            contacts.frombytes(base64.b64decode(state['contact_index']))
+            self.contact_index = set(contacts)
+            # Rows added while the bot was down are picked up by the next poll
+            self.last_row_count = state['last_row_count']
+            self._checkpoint_saved_at = state['saved_at']
+            return True
         except Exception as e:
-            print(f"Error checking for new leads: {e}")
+            print(f"Error loading checkpoint: {e}")
+            return False
+    
+    def metrics(self):
+        """Counters and state for /metrics"""
+        now = time.time()
+        return {
+            'sheet_id': self.sheet_id,
+            'sheet_tab': self.sheet_tab,
+            'initialized': self.initialized,
+            'seconds_since_poll': round(now - self.last_poll_ok_at) if self.last_poll_ok_at else None,
+            'seconds_since_delivery': round(now - self.last_delivery_ok_at) if self.last_delivery_ok_at else None,
+            'last_row_count': self.last_row_count,
+            'processed_leads': len(self.processed_leads),
+            'contact_index': len(self.contact_index),
+            'polls': self.polls,
+            'poll_errors': self.poll_errors,
+            'leads_sent': self.leads_sent,
+            'leads_failed': self.leads_failed,
+            'delivery_latency': {
+                f'priority_{priority}': {
+                    'delivered': delivered,
+                    'avg_seconds': round(total / delivered, 3),
+                    'max_seconds': round(longest, 3),
+                }
+                for priority, (delivered, total, longest) in sorted(self.delivery_latency.items())
+            },
+            'enrichment': enrichment_stats(self.campaigns) if self.enrichment else None,
+            'writeback_rows': self.writeback_rows,
+            'writeback_pending': len(self._pending_writeback),
+            'writeback_errors': self.writeback_errors,
+            'pipeline': self.pipeline.stats() if self.pipeline else {},
+            'circuits': {
+                name: service.breaker.stats()
+                for name, service in (('sheets', self.sheets_service), ('sheets_writes', self.writeback_service),
+                                      ('telegram', self.telegram_service))
+                if getattr(service, 'breaker', None)
+            },
+        }
+    
+    def request_reload(self):
+        """Ask the monitoring loop to reload its configuration before the next cycle"""
+        self._reload_requested = True
+        self._wake.set()
+    
+    def request_shutdown(self):
+        """Ask the monitoring loop to drain in-flight notifications and exit"""
+        self._stopping = True
+        self._wake.set()
+    
+    def _get_config_mtime(self):
+        try:
+            return os.path.getmtime(CONFIG_FILE)
+        except OSError:
+            return None
+    
+    def _config_file_changed(self):
+        mtime = self._get_config_mtime()
+        if mtime == self._config_mtime:
+            return False
+        self._config_mtime = mtime
+        return True
+    
+    async def reload_config(self):
+        """Apply changed runtime settings; only called between cycles, so it is atomic for the pipeline"""
+        self._reload_requested = False
+        try:
+            settings = load_runtime_settings()
+        except Exception as e:
+            print(f"Error reloading configuration, keeping the current one: {e}")
+            return
+        
+        if settings['allowed_users'] != self.telegram_service.allowed_users:
+            print(f"Allowed users changed to {settings['allowed_users']}")
+            self.telegram_service.allowed_users = settings['allowed_users']
+        
+        self.load_routing_rules()
+        
+        if settings['check_interval_minutes'] != self.check_interval_minutes:
+            print(f"Check interval changed to {settings['check_interval_minutes']} minutes")
+            self.check_interval_minutes = settings['check_interval_minutes']
+        
+        if settings['sheet_tab'] != self.sheet_tab:
+            print(f"Monitored tab changed from {self.sheet_tab} to {settings['sheet_tab']}")
+            # Let leads from the old tab finish before switching the cursor over
+            if self.pipeline:
+                await self.pipeline.join()
+            if self._pending_writeback:
+                await self.flush_writeback()
+            self._pending_writeback = {}
+            self._writeback_header_written = False
+            self.sheet_tab = settings['sheet_tab']
+            self.last_row_count = 0
+            self.processed_leads = set()
+            self.contact_index = set()
+            self.initialized = False
+            await self.initialize()
+    
+    async def _wait_for_next_cycle(self, seconds):
+        """Sleep until the next cycle, waking early on reload or shutdown requests"""
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def shutdown(self):
+        """Drain in-flight notifications and checkpoint state"""
+        drained = True
+        if self.pipeline:
+            try:
+                await asyncio.wait_for(self.pipeline.join(), timeout=SHUTDOWN_DRAIN_SECONDS)
+            except asyncio.TimeoutError:
+                print(f"Pipeline did not drain within {SHUTDOWN_DRAIN_SECONDS}s: {self.pipeline.queue_depths()}")
+            drained = self.pipeline.is_idle()
+            await self.pipeline.stop(drain=False)
+        if self._pending_writeback:
+            await self.flush_writeback()
+        if not self.initialized:
+            return
+        if drained:
+            self.save_checkpoint()
+        else:
+            # The cursor and dedup set already cover the queued leads: saving them now would
+            # mark those as delivered. The last idle checkpoint makes the restart poll them again.
+            print("Undelivered leads still queued, keeping the last consistent checkpoint")
     
     async def run_monitor(self):
         """Run the monitoring loop"""
-        print(f"Starting leads monitor for sheet: {GOOGLE_SHEET_ID}")
-        print(f"Monitoring tab: {GOOGLE_SHEET_TAB}")
-        print(f"Check interval: {CHECK_INTERVAL_MINUTES} minutes")
+        print(f"Starting leads monitor for sheet: {self.sheet_id}")
+        print(f"Monitoring tab: {self.sheet_tab}")
+        print(f"Check interval: {self.check_interval_minutes} minutes")
         print(f"Allowed users: {self.telegram_service.allowed_users}")
         
         await self.initialize()
@@ -252,13 +870,31 @@ class LeadsMonitor:
             print("Failed to initialize monitor. Exiting.")
             return
         
-        while True:
-            try:
-                await self.check_for_new_leads()
-                await asyncio.sleep(CHECK_INTERVAL_MINUTES * 60)
-            except KeyboardInterrupt:
-                print("\nMonitor stopped by user")
-                break
-            except Exception as e:
-                print(f"Error in monitoring loop: {e}")
-                await asyncio.sleep(60)  # Wait 1 minute before retrying
+        await self.start_pipeline()
+        try:
+            while not self._stopping:
+                try:
+                    if self._reload_requested or self._config_file_changed():
+                        await self.reload_config()
+                    if not self.initialized:
+                        await self.initialize()
+                        if not self.initialized:
+                            await self._wait_for_next_cycle(60)
+                            continue
+                    self.checkpoint_if_idle()
+                    
+                    # Polls don't wait for sends: slow deliveries only queue up in front of the sender
+                    await self.pipeline.put('poll')
+                    depths = self.pipeline.queue_depths()
+                    if any(depth for stage, depth in depths.items() if stage != 'poller'):
+                        print(f"Pipeline queue depths: {depths}")
+                    await self._wait_for_next_cycle(self.check_interval_minutes * 60)
+                except KeyboardInterrupt:
+                    print("\nMonitor stopped by user")
+                    break
+                except Exception as e:
+                    print(f"Error in monitoring loop: {e}")
+                    await self._wait_for_next_cycle(60)  # Wait 1 minute before retrying
+        finally:
+            print("Shutting down monitor...")
+            await self.shutdown()
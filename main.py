@@ -4,11 +4,18 @@ Tokyo Garden Clinic - Telegram Leads Bot
 Monitors Google Sheets for new leads and sends notifications via Telegram
 """
 
+import argparse
 import asyncio
+import signal
 import sys
+from datetime import datetime
 from leads_monitor import LeadsMonitor
+from health import HealthMonitor
+from backfill import Backfill, parse_date_argument
 from telegram_service import TelegramService
-from config import TELEGRAM_ALLOWED_USERS
+from tenant_registry import TenantRegistry
+from memory_stats import MemoryProfiler
+from config import TELEGRAM_ALLOWED_USERS, BACKFILL_WINDOW_ROWS, TENANTS_FILE, MEMSTATS_ENABLED
 
 async def test_telegram_connection():
     """Test the Telegram bot connection and get user IDs"""
@@ -38,12 +45,33 @@ async def test_telegram_connection():
         print("❌ Failed to connect to Telegram bot!")
         return False
 
+def install_signal_handlers(monitor):
+    """SIGTERM/SIGINT drain and checkpoint, SIGHUP reloads the configuration (a LeadsMonitor or TenantRegistry)"""
+    loop = asyncio.get_running_loop()
+    handlers = {
+        signal.SIGTERM: monitor.request_shutdown,
+        signal.SIGINT: monitor.request_shutdown,
+    }
+    if hasattr(signal, 'SIGHUP'):
+        handlers[signal.SIGHUP] = monitor.request_reload
+    
+    for sig, handler in handlers.items():
+        try:
+            loop.add_signal_handler(sig, handler)
+        except NotImplementedError:
+            # Windows event loops don't support signal handlers, Ctrl+C still raises KeyboardInterrupt
+            pass
+
 async def main():
     """Main function"""
     print("=" * 60)
     print("Tokyo Garden Clinic - Telegram Leads Bot")
     print("=" * 60)
     
+    if TENANTS_FILE:
+        await run_tenants()
+        return
+    
     # Test Telegram connection first
     if not await test_telegram_connection():
         print("Please fix the Telegram configuration before continuing.")
@@ -55,11 +83,77 @@ async def main():
     
     # Start monitoring
     monitor = LeadsMonitor()
-    await monitor.run_monitor()
+    install_signal_handlers(monitor)
+    memory = MemoryProfiler(monitor) if MEMSTATS_ENABLED else None
+    health = HealthMonitor(monitor, memory=memory)
+    await health.start()
+    if memory:
+        await memory.start(monitor.telegram_service)
+    try:
+        await monitor.run_monitor()
+    finally:
+        if memory:
+            await memory.stop()
+        await health.stop()
+
+async def run_tenants():
+    """Monitor every clinic listed in TENANTS_FILE from this one process"""
+    print(f"Multi-tenant mode, tenants from {TENANTS_FILE}")
+    print("Press Ctrl+C to stop the monitor")
+    print("-" * 60)
+    
+    registry = TenantRegistry()
+    install_signal_handlers(registry)
+    memory = MemoryProfiler(registry) if MEMSTATS_ENABLED else None
+    health = HealthMonitor(registry, memory=memory)
+    await health.start()
+    if memory:
+        # Memory is per process, so /memstats is answered by the operator's bot rather than every clinic's
+        await memory.start(TelegramService())
+    try:
+        await registry.run()
+    finally:
+        if memory:
+            await memory.stop()
+        await health.stop()
+
+async def run_backfill(args):
+    """Re-send leads from a date range to the given chats"""
+    since = parse_date_argument(args.since)
+    until = parse_date_argument(args.until, end_of_day=True) if args.until else datetime.now()
+    
+    monitor = LeadsMonitor()
+    backfill = Backfill(monitor, since, until, args.to, window_rows=args.window)
+    if args.restart:
+        backfill.clear_checkpoint()
+    
+    if args.dry_run:
+        await backfill.dry_run()
+    else:
+        await backfill.run()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tokyo Garden Clinic - Telegram Leads Bot")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help="Monitor the sheet and send notifications (default)")
+    
+    backfill_parser = subparsers.add_parser('backfill', help="Re-send leads submitted in a date range")
+    backfill_parser.add_argument('--since', required=True, help="Start date, YYYY-MM-DD or 'YYYY-MM-DD HH:MM'")
+    backfill_parser.add_argument('--until', help="End date (inclusive), defaults to now")
+    backfill_parser.add_argument('--to', required=True, type=int, action='append',
+                                 help="Chat ID to notify (repeatable)")
+    backfill_parser.add_argument('--dry-run', action='store_true', help="Count matching leads and estimate duration")
+    backfill_parser.add_argument('--restart', action='store_true', help="Ignore any saved progress")
+    backfill_parser.add_argument('--window', type=int, default=BACKFILL_WINDOW_ROWS, help="Rows read per request")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(main())
+        if args.command == 'backfill':
+            asyncio.run(run_backfill(args))
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("\n👋 Goodbye!")
     except Exception as e:
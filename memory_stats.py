@@ -0,0 +1,305 @@
+"""
+Opt-in memory instrumentation for a bot that runs for weeks (MEMSTATS_ENABLED=true).
+
+Every MEMSTATS_INTERVAL_SECONDS a sample records the RSS, tracemalloc's traced memory, the
+number of objects per type and the size of each monitor's dedup state, and diffs the
+allocation sites against the previous sample and the first one. Growth per hour is computed
+over the kept samples, so a leak shows up as a trend (and a projected time until the
+container's memory limit) long before the limit is hit. The latest report is served under
+"memory" in /metrics and by the /memstats bot command.
+
+tracemalloc slows allocations down and adds its own memory per allocated block, which is
+why this is off by default. Only per-line totals of the snapshots are kept between samples.
+"""
+
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter, deque
+from config import MEMSTATS_INTERVAL_SECONDS, MEMSTATS_TOP_N, MEMSTATS_FRAMES, MEMSTATS_HISTORY
+
+MIB = 1024 * 1024
+LIMIT_WARNING_HOURS = 24  # Warn when the RSS trend reaches the memory limit within this time
+FINGERPRINT_BYTES = sys.getsizeof(1 << 63)  # Every fingerprint in the dedup sets is a 64-bit int object
+STATE_ATTRIBUTES = ('processed_leads', 'contact_index', '_pending_writeback')
+# Don't report the allocations made by importing modules or by the instrumentation itself
+IGNORED_FILES = frozenset((
+    tracemalloc.__file__, __file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>',
+    '<unknown>',
+))
+
+
+def read_rss_bytes():
+    """Current resident set size from /proc, or the peak RSS where /proc doesn't exist"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def read_memory_limit_bytes():
+    """The container's memory limit (cgroup v2 or v1), None when there is none"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as limit_file:
+                value = limit_file.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:  # cgroup v1 reports "no limit" as a huge number
+            return int(value)
+    return None
+
+
+def _short_path(filename):
+    """Path relative to the sys.path entry it was imported from"""
+    for prefix in sorted((path for path in sys.path if path), key=len, reverse=True):
+        if filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+def _type_name(cls):
+    return cls.__qualname__ if cls.__module__ == 'builtins' else f'{cls.__module__}.{cls.__qualname__}'
+
+
+def _mib(value):
+    return round(value / MIB, 1) if value is not None else None
+
+
+class MemoryProfiler:
+    """Periodic memory samples of a LeadsMonitor or TenantRegistry and the process around it"""
+
+    def __init__(self, target, interval=MEMSTATS_INTERVAL_SECONDS, top_n=MEMSTATS_TOP_N,
+                 frames=MEMSTATS_FRAMES, history=MEMSTATS_HISTORY):
+        self.target = target
+        self.interval = interval
+        self.top_n = top_n
+        self.frames = frames
+        self.samples = deque(maxlen=history)  # Scalar measurements, oldest first
+        self.limit_bytes = read_memory_limit_bytes()
+        self.top_growth = []  # Allocation sites that grew most since the previous sample
+        self.top_since_start = []  # ... and since the first sample
+        self.top_types = []
+        self.type_growth = []
+        self._first_sites = None
+        self._last_sites = None
+        self._last_type_counts = None
+        self._started_tracing = False
+        self._tasks = []
+
+    async def start(self, telegram_service=None):
+        """Start tracing and sampling, and answer /memstats through telegram_service's bot"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self._tasks.append(asyncio.create_task(self._run(), name="memstats"))
+        if telegram_service is not None:
+            self._tasks.append(asyncio.create_task(
+                telegram_service.listen_for_commands({'memstats': self.format_report}), name="memstats-commands"
+            ))
+        print(f"Memory instrumentation on, sampling every {self.interval:g}s")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    async def _run(self):
+        while True:
+            try:
+                # Read the dedup state on the loop, the pipeline changes it there
+                state = self.state_sizes()
+                await asyncio.to_thread(self.sample, state)
+                self._log()
+            except Exception as e:
+                print(f"Error sampling memory: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _monitors(self):
+        if hasattr(self.target, 'tenants'):
+            return self.target.tenants
+        return {'': self.target}
+
+    def state_sizes(self):
+        """Entries and approximate bytes of each monitor's dedup state"""
+        sizes = {}
+        for name, monitor in list(self._monitors().items()):
+            for attribute in STATE_ATTRIBUTES:
+                value = getattr(monitor, attribute, None)
+                if value is None:
+                    continue
+                key = f'{name}.{attribute.lstrip("_")}' if name else attribute.lstrip('_')
+                sizes[key] = {
+                    'entries': len(value),
+                    'bytes': sys.getsizeof(value) + (len(value) * FINGERPRINT_BYTES if isinstance(value, set) else 0),
+                }
+        return sizes
+
+    def sample(self, state=None):
+        """Take one sample; blocking, the snapshot and object walk take a while on a big heap"""
+        snapshot = tracemalloc.take_snapshot()
+        sites = {}
+        # Filtering the grouped lines is much faster than Snapshot.filter_traces() on every block
+        for stat in snapshot.statistics('lineno'):
+            frame = stat.traceback[0]
+            if frame.filename not in IGNORED_FILES:
+                sites[f'{_short_path(frame.filename)}:{frame.lineno}'] = (stat.size, stat.count)
+        del snapshot
+        if self._first_sites is None:
+            self._first_sites = sites
+        self.top_growth = self._site_growth(sites, self._last_sites or sites)
+        self.top_since_start = self._site_growth(sites, self._first_sites)
+        self._last_sites = sites
+
+        type_counts = Counter(map(type, gc.get_objects()))
+        previous_counts = self._last_type_counts or type_counts
+        self.top_types = [
+            {'type': _type_name(cls), 'count': count} for cls, count in type_counts.most_common(self.top_n)
+        ]
+        growth = sorted(
+            ((count - previous_counts.get(cls, 0), cls, count) for cls, count in type_counts.items()),
+            key=lambda item: item[0], reverse=True,
+        )
+        self.type_growth = [
+            {'type': _type_name(cls), 'count_diff': diff, 'count': count}
+            for diff, cls, count in growth[:self.top_n] if diff > 0
+        ]
+        self._last_type_counts = type_counts
+
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        self.samples.append({
+            'time': time.time(),
+            'rss_bytes': read_rss_bytes(),
+            'traced_bytes': traced,
+            'traced_peak_bytes': traced_peak,
+            'gc_objects': sum(type_counts.values()),
+            'state': state if state is not None else {},
+        })
+
+    def _site_growth(self, sites, baseline):
+        growth = sorted(
+            ((size - baseline.get(site, (0, 0))[0], count - baseline.get(site, (0, 0))[1], site, size)
+             for site, (size, count) in sites.items()),
+            key=lambda item: item[0], reverse=True,
+        )
+        return [
+            {'site': site, 'size_diff_kib': round(diff / 1024, 1), 'count_diff': count_diff,
+             'size_kib': round(size / 1024, 1)}
+            for diff, count_diff, site, size in growth[:self.top_n] if diff > 0
+        ]
+
+    def growth_per_hour(self):
+        """Change per hour of every measurement between the oldest and newest kept sample"""
+        if len(self.samples) < 2:
+            return {}
+        first, last = self.samples[0], self.samples[-1]
+        hours = (last['time'] - first['time']) / 3600
+        if hours <= 0:
+            return {}
+        growth = {}
+        for key in ('rss_bytes', 'traced_bytes', 'gc_objects'):
+            if first[key] is not None and last[key] is not None:
+                growth[key] = (last[key] - first[key]) / hours
+        for key, size in last['state'].items():
+            if key in first['state']:
+                growth[f'{key}.entries'] = (size['entries'] - first['state'][key]['entries']) / hours
+        return growth
+
+    def hours_to_limit(self, growth=None):
+        """Hours until the RSS reaches the memory limit at the current trend, None if it isn't growing"""
+        growth = self.growth_per_hour() if growth is None else growth
+        rss = self.samples[-1]['rss_bytes'] if self.samples else None
+        if not self.limit_bytes or rss is None or growth.get('rss_bytes', 0) <= 0:
+            return None
+        return max(0.0, (self.limit_bytes - rss) / growth['rss_bytes'])
+
+    def report(self):
+        """Latest sample, trends and top allocation sites and types, for /metrics"""
+        if not self.samples:
+            return {'samples': 0, 'interval_seconds': self.interval}
+        latest = self.samples[-1]
+        growth = self.growth_per_hour()
+        hours_to_limit = self.hours_to_limit(growth)
+        return {
+            'samples': len(self.samples),
+            'interval_seconds': self.interval,
+            'sampled_seconds_ago': round(time.time() - latest['time']),
+            'rss_mib': _mib(latest['rss_bytes']),
+            'limit_mib': _mib(self.limit_bytes),
+            'hours_to_limit': round(hours_to_limit, 1) if hours_to_limit is not None else None,
+            'traced_mib': _mib(latest['traced_bytes']),
+            'traced_peak_mib': _mib(latest['traced_peak_bytes']),
+            'gc_objects': latest['gc_objects'],
+            'state': latest['state'],
+            'growth_per_hour': {
+                key.replace('_bytes', '_mib'): round(value / MIB, 3) if key.endswith('_bytes') else round(value, 1)
+                for key, value in growth.items()
+            },
+            'top_growth': self.top_growth,
+            'top_since_start': self.top_since_start,
+            'top_types': self.top_types,
+            'type_growth': self.type_growth,
+        }
+
+    def format_report(self, limit=5):
+        """Short plain-text report for the /memstats command"""
+        report = self.report()
+        if not report['samples']:
+            return "🧠 No memory sample yet, the first one is taken at startup."
+        growth = report['growth_per_hour']
+        lines = [
+            "🧠 Memory",
+            f"RSS: {report['rss_mib']} MiB ({growth.get('rss_mib', 0):+.2f} MiB/h)"
+            + (f" of {report['limit_mib']} MiB" if report['limit_mib'] else ""),
+            f"Traced: {report['traced_mib']} MiB (peak {report['traced_peak_mib']} MiB)",
+            f"Objects: {report['gc_objects']} ({growth.get('gc_objects', 0):+.0f}/h)",
+        ]
+        if report['hours_to_limit'] is not None:
+            lines.append(f"⚠️ Limit reached in ~{report['hours_to_limit']:.0f}h at this rate")
+        lines.append("")
+        lines.append("📦 State:")
+        for key, size in report['state'].items():
+            lines.append(f"{key}: {size['entries']} ({size['bytes'] / MIB:.1f} MiB, "
+                         f"{growth.get(key + '.entries', 0):+.0f}/h)")
+        for title, entries, describe in (
+            ("📈 Grew since last sample:", report['top_growth'],
+             lambda entry: f"{entry['site']} {entry['size_diff_kib']:+.1f} KiB"),
+            ("📈 Grew since start:", report['top_since_start'],
+             lambda entry: f"{entry['site']} {entry['size_diff_kib']:+.1f} KiB"),
+            ("🔢 Types growing:", report['type_growth'],
+             lambda entry: f"{entry['type']} {entry['count_diff']:+d} ({entry['count']})"),
+        ):
+            if entries:
+                lines.append("")
+                lines.append(title)
+                lines.extend(describe(entry) for entry in entries[:limit])
+        lines.append("")
+        lines.append(f"{report['samples']} samples, last {report['sampled_seconds_ago']}s ago")
+        return "\n".join(lines)
+
+    def _log(self):
+        latest = self.samples[-1]
+        growth = self.growth_per_hour()
+        state = ", ".join(f"{key} {size['entries']}" for key, size in latest['state'].items())
+        print(f"Memory: RSS {_mib(latest['rss_bytes'])} MiB ({growth.get('rss_bytes', 0) / MIB:+.2f} MiB/h), "
+              f"traced {_mib(latest['traced_bytes'])} MiB, {latest['gc_objects']} objects"
+              + (f", {state}" if state else ""))
+        hours_to_limit = self.hours_to_limit(growth)
+        if hours_to_limit is not None and hours_to_limit < LIMIT_WARNING_HOURS:
+            print(f"⚠️  At this rate memory reaches the {_mib(self.limit_bytes)} MiB limit in {hours_to_limit:.1f}h")
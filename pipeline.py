@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+
+class Stage:
+    """
+    One pipeline step: a bounded input queue served by a fixed number of workers.
+
+    With a priority function the queue hands out the item with the smallest priority(item)
+    first instead of the oldest; items with equal keys keep their order.
+    """
+
+    def __init__(self, name, handler, concurrency=1, queue_size=100, priority=None):
+        self.name = name
+        self.handler = handler  # async callable returning an iterable of outputs, or None
+        self.concurrency = max(1, concurrency)
+        self.queue_size = queue_size
+        self.priority = priority
+        self._sequence = 0
+        self.queue = None
+        self.next_stage = None
+        self.processed = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._started = {}  # Worker index -> monotonic start time of its current item
+        self._workers = []
+
+    def start(self):
+        queue_class = asyncio.PriorityQueue if self.priority else asyncio.Queue
+        self.queue = queue_class(maxsize=self.queue_size)
+        self._workers = [
+            asyncio.create_task(self._work(i), name=f"pipeline-{self.name}-{i}")
+            for i in range(self.concurrency)
+        ]
+
+    def _entry(self, item):
+        if self.priority is None:
+            return item
+        # The sequence number breaks ties, so items themselves are never compared
+        self._sequence += 1
+        return self.priority(item), self._sequence, item
+
+    async def put(self, item):
+        """Queue an item, waiting while the stage is full"""
+        await self.queue.put(self._entry(item))
+
+    def put_nowait(self, item):
+        self.queue.put_nowait(self._entry(item))
+
+    async def _work(self, worker):
+        while True:
+            item = await self.queue.get()
+            if self.priority:
+                item = item[-1]
+            self.in_flight += 1
+            self._started[worker] = time.monotonic()
+            try:
+                outputs = await self.handler(item)
+                self.processed += 1
+                if outputs and self.next_stage:
+                    for output in outputs:
+                        # Blocks while the next stage is full, pushing back on this one
+                        await self.next_stage.put(output)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error in {self.name} stage: {e}")
+            finally:
+                self.in_flight -= 1
+                self._started.pop(worker, None)
+                self.queue.task_done()
+
+    def longest_running(self):
+        """Seconds the oldest in-progress item has been running, 0 when idle"""
+        started = list(self._started.values())  # Read from the watchdog thread too
+        if not started:
+            return 0
+        return time.monotonic() - min(started)
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+class Pipeline:
+    """Chain of stages connected by bounded asyncio queues"""
+
+    def __init__(self, stages):
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+        self.running = False
+
+    async def start(self):
+        if self.running:
+            return
+        for stage in self.stages:
+            stage.start()
+        self.running = True
+
+    async def put(self, item):
+        """Feed an item into the first stage, waiting while it is full"""
+        await self.stages[0].put(item)
+
+    def offer(self, item):
+        """Feed an item into the first stage without waiting, returns False if it is full"""
+        try:
+            self.stages[0].put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def join(self):
+        """Wait until every item fed so far has left the last stage"""
+        # Stages are joined in order: once a stage is drained its outputs are already queued downstream
+        for stage in self.stages:
+            await stage.queue.join()
+
+    async def stop(self, drain=True):
+        """Stop all workers, by default after letting in-flight items finish"""
+        if not self.running:
+            return
+        if drain:
+            await self.join()
+        for stage in self.stages:
+            await stage.stop()
+        self.running = False
+
+    def is_idle(self):
+        """True when no stage has queued or in-progress items"""
+        return all(
+            stage.in_flight == 0 and (stage.queue is None or stage.queue.empty())
+            for stage in self.stages
+        )
+
+    def queue_depths(self):
+        """Current number of items waiting in front of each stage"""
+        return {stage.name: stage.queue.qsize() if stage.queue else 0 for stage in self.stages}
+
+    def stats(self):
+        return {
+            stage.name: {
+                'queued': stage.queue.qsize() if stage.queue else 0,
+                'processed': stage.processed,
+                'errors': stage.errors,
+                'concurrency': stage.concurrency,
+                'longest_running_seconds': round(stage.longest_running(), 3),
+            }
+            for stage in self.stages
+        }
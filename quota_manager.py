@@ -0,0 +1,133 @@
+"""
+Sheets API read-quota accounting shared by every target and process on this host.
+
+Reads are recorded in a sliding window kept in a small JSON file, which is locked while
+it is read and rewritten so several bot processes cooperate on the same budget.
+"""
+
+import json
+import os
+import threading
+import time
+from config import (
+    QUOTA_STATE_FILE, SHEETS_READS_PER_MINUTE, QUOTA_LOW_PRIORITY_SHARE, QUOTA_FAIR_SHARE_THRESHOLD
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads in this process are coordinated
+    fcntl = None
+
+PRIORITY_POLL = 0  # Scheduled polls, always served first
+PRIORITY_RESYNC = 1  # Full loads, backfills and other work that can wait
+
+WINDOW_SECONDS = 60
+
+
+class QuotaManager:
+    """Sliding-window read budget with fair shares per target and deferral of low-priority work"""
+
+    def __init__(self, state_file=QUOTA_STATE_FILE, reads_per_minute=SHEETS_READS_PER_MINUTE,
+                 low_priority_share=QUOTA_LOW_PRIORITY_SHARE, fair_share_threshold=QUOTA_FAIR_SHARE_THRESHOLD):
+        self.state_file = state_file
+        self.budget = reads_per_minute
+        self.low_priority_share = low_priority_share
+        self.fair_share_threshold = fair_share_threshold
+        self._lock = threading.Lock()
+
+    def _update_state(self, update):
+        """Run update(state) under the cross-process lock and persist the result"""
+        with self._lock:
+            with open(self.state_file, 'a+') as state_file:
+                if fcntl:
+                    fcntl.flock(state_file, fcntl.LOCK_EX)
+                try:
+                    state_file.seek(0)
+                    content = state_file.read()
+                    try:
+                        state = json.loads(content) if content else {}
+                    except ValueError:
+                        state = {}  # A corrupt file only costs us the current window
+                    state.setdefault('events', [])
+                    state.setdefault('blocked_until', 0)
+
+                    now = time.time()
+                    state['events'] = [event for event in state['events'] if event[0] > now - WINDOW_SECONDS]
+                    result = update(state, now)
+
+                    state_file.seek(0)
+                    state_file.truncate()
+                    json.dump(state, state_file)
+                    state_file.flush()
+                    return result
+                finally:
+                    if fcntl:
+                        fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def _wait_time(self, state, now, target, priority, cost):
+        """Seconds until this request fits the budget, 0 if it can go now"""
+        if state['blocked_until'] > now:
+            return state['blocked_until'] - now
+
+        events = state['events']
+        used = sum(event[2] for event in events)
+        limit = self.budget if priority == PRIORITY_POLL else self.budget * self.low_priority_share
+
+        if used + cost <= limit:
+            if priority != PRIORITY_POLL or used + cost <= self.budget * self.fair_share_threshold:
+                return 0
+            # Budget is tight: a target may only take its fair share of what is left
+            targets = {event[1] for event in events} | {target}
+            target_used = sum(event[2] for event in events if event[1] == target)
+            if target_used + cost <= self.budget / len(targets):
+                return 0
+            own_events = [event for event in events if event[1] == target]
+            return own_events[0][0] + WINDOW_SECONDS - now
+
+        # Wait until enough of the oldest reads leave the window
+        freed = 0
+        for timestamp, _, event_cost in events:
+            freed += event_cost
+            if used - freed + cost <= limit:
+                return timestamp + WINDOW_SECONDS - now
+        return WINDOW_SECONDS
+
+    def try_acquire(self, target, priority=PRIORITY_POLL, cost=1):
+        """Record the read and return 0 if it fits the budget, otherwise return the seconds to wait"""
+        def update(state, now):
+            wait = self._wait_time(state, now, target, priority, cost)
+            if wait <= 0:
+                state['events'].append([now, target, cost])
+                return 0
+            return wait
+        return self._update_state(update)
+
+    def acquire(self, target, priority=PRIORITY_POLL, cost=1):
+        """Block until the read fits the budget, then record it"""
+        while True:
+            wait = self.try_acquire(target, priority, cost)
+            if wait <= 0:
+                return
+            print(f"Sheets quota: deferring {'poll' if priority == PRIORITY_POLL else 'low-priority'} "
+                  f"read for {target} by {wait:.1f}s")
+            time.sleep(min(wait, WINDOW_SECONDS))
+
+    def report_rate_limited(self, retry_after=None):
+        """Make every process back off after the API answered 429"""
+        def update(state, now):
+            state['blocked_until'] = max(state['blocked_until'], now + (retry_after or WINDOW_SECONDS))
+        self._update_state(update)
+
+    def usage(self):
+        """Reads per target in the current window"""
+        def update(state, now):
+            per_target = {}
+            for _, target, cost in state['events']:
+                per_target[target] = per_target.get(target, 0) + cost
+            return {
+                'budget': self.budget,
+                'used': sum(per_target.values()),
+                'targets': per_target,
+                'blocked_for': max(0, state['blocked_until'] - now),
+            }
+        return self._update_state(update)
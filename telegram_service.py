@@ -1,31 +1,66 @@
 import asyncio
 from telegram import Bot
-from telegram.error import TelegramError
-from config import TELEGRAM_BOT_TOKEN, TELEGRAM_ALLOWED_USERS
+from datetime import datetime, timezone
+from telegram.error import TelegramError, RetryAfter, NetworkError, BadRequest, Conflict
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from traffic_trace import get_recorder
+from config import TELEGRAM_BOT_TOKEN, TELEGRAM_ALLOWED_USERS, COMMAND_POLL_TIMEOUT_SECONDS
+
+MAX_MESSAGE_LENGTH = 4096
+MAX_CONFLICT_BACKOFF_SECONDS = 600
 
 class TelegramService:
-    def __init__(self):
-        self.bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        self.allowed_users = TELEGRAM_ALLOWED_USERS
+    def __init__(self, token=TELEGRAM_BOT_TOKEN, allowed_users=None, request=None):
+        # Passing one request object to many bots makes them share its connection pool
+        self.bot = Bot(token=token, request=request, get_updates_request=request)
+        recorder = get_recorder()
+        if recorder:
+            self.bot = recorder.wrap_bot(self.bot)
+        self.allowed_users = TELEGRAM_ALLOWED_USERS if allowed_users is None else allowed_users
+        self.routed_chats = set()  # Extra chats/groups configured in the routing rules
+        self.breaker = CircuitBreaker('Telegram')
     
     async def send_notification(self, user_id, message):
-        """Send a notification to a specific user"""
-        if user_id not in self.allowed_users:
+        """Send a notification to a specific user; None instead of False when the open breaker refused it"""
+        if user_id not in self.allowed_users and user_id not in self.routed_chats:
             print(f"User {user_id} is not authorized to receive notifications")
             return False
         
         try:
-            await self.bot.send_message(chat_id=user_id, text=message)
+            self.breaker.before_call()
+        except CircuitOpenError as e:
+            print(f"Not sending to user {user_id}: {e}")
+            return None
+        
+        try:
+            try:
+                await self.bot.send_message(chat_id=user_id, text=message)
+            except RetryAfter as e:
+                # Flood control: Telegram tells us exactly how long to wait
+                print(f"Rate limited sending to user {user_id}, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+                await self.bot.send_message(chat_id=user_id, text=message)
+            self.breaker.record_success()
             print(f"Notification sent to user {user_id}")
             return True
         except TelegramError as e:
+            # Network errors and timeouts mean Telegram is unreachable; anything else (blocked
+            # bot, bad chat ID) is specific to this chat and proves the API itself is up
+            if isinstance(e, (NetworkError, RetryAfter)) and not isinstance(e, BadRequest):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
             print(f"Error sending notification to user {user_id}: {e}")
             return False
     
     async def send_notifications_to_all(self, message):
         """Send notification to all allowed users"""
+        return await self.send_notifications_to(self.allowed_users, message)
+    
+    async def send_notifications_to(self, user_ids, message):
+        """Send notification to the given users or chats"""
         tasks = []
-        for user_id in self.allowed_users:
+        for user_id in user_ids:
             tasks.append(self.send_notification(user_id, message))
         
         if tasks:
@@ -33,6 +68,62 @@ class TelegramService:
             return all(result for result in results if not isinstance(result, Exception))
         return False
     
+    async def listen_for_commands(self, commands, poll_timeout=COMMAND_POLL_TIMEOUT_SECONDS):
+        """
+        Answer bot commands from allowed users by long-polling getUpdates until cancelled.
+        
+        commands maps a command name without the slash to a function returning the reply text.
+        Commands sent before the listener started are not answered, other messages are ignored.
+        
+        Telegram gives a bot's updates to one getUpdates consumer and drops the ones it has read,
+        so the listener needs the bot to itself: don't run get_user_id.py, another instance or a
+        webhook for the same bot while it listens. While one does, Telegram answers with a
+        Conflict and the listener backs off instead of competing for the updates.
+        """
+        offset = None
+        started = datetime.now(timezone.utc)
+        conflict_backoff = max(poll_timeout, 1)
+        while True:
+            try:
+                updates = await self.bot.get_updates(
+                    offset=offset, timeout=poll_timeout, allowed_updates=['message'],
+                    read_timeout=poll_timeout + 10
+                )
+            except Conflict as e:
+                print(f"Another getUpdates consumer or a webhook is using this bot, "
+                      f"bot commands paused for {conflict_backoff}s: {e}")
+                await asyncio.sleep(conflict_backoff)
+                conflict_backoff = min(conflict_backoff * 2, MAX_CONFLICT_BACKOFF_SECONDS)
+                continue
+            except TelegramError as e:
+                print(f"Error polling bot commands: {e}")
+                await asyncio.sleep(poll_timeout)
+                continue
+            conflict_backoff = max(poll_timeout, 1)
+            
+            for update in updates:
+                offset = update.update_id + 1
+                message = update.message
+                if not message or not message.text or not message.text.startswith('/'):
+                    continue
+                if message.date and message.date < started:
+                    continue
+                name = message.text.split()[0][1:].split('@')[0].lower()
+                if name not in commands:
+                    continue
+                user_id = message.from_user.id if message.from_user else None
+                if user_id not in self.allowed_users:
+                    print(f"Ignoring /{name} from unauthorized user {user_id}")
+                    continue
+                try:
+                    reply = commands[name]()
+                except Exception as e:
+                    reply = f"Error running /{name}: {e}"
+                try:
+                    await self.bot.send_message(chat_id=message.chat_id, text=reply[:MAX_MESSAGE_LENGTH])
+                except TelegramError as e:
+                    print(f"Error answering /{name}: {e}")
+    
     async def get_bot_info(self):
         """Get bot information"""
         try:
@@ -0,0 +1,268 @@
+"""
+Run many clinics in one process.
+
+TENANTS_FILE is a JSON list with one object per clinic:
+
+  [
+    {"name": "tokyo-garden", "sheet_id": "14bx...", "sheet_tab": "facebook",
+     "telegram_bot_token": "123:abc", "allowed_users": [7027631325]},
+    {"name": "ginza", "sheet_id": "1Abc...", "sheet_tab": "tiktok", "check_interval_minutes": 2,
+     "telegram_bot_token": "456:def", "allowed_users": "-100987654,7027631325",
+     "routing_rules_file": "ginza_rules.json", "google_refresh_token": "1//0g...",
+     "writeback": true, "writeback_column": "Q", "google_write_refresh_token": "1//0h...",
+     "campaign_lookup_tab": "campaigns"}
+  ]
+
+Only "name" and "sheet_id" are required, the other keys default to the single-clinic
+settings. Tenants without a google_refresh_token read their sheet with the bot's own Google
+account, and without a google_write_refresh_token write to it with GOOGLE_WRITE_REFRESH_TOKEN.
+Each tenant gets its own LeadsMonitor, pipeline, snapshot and checkpoint (under
+TENANTS_DIR/<name>); the Sheets clients and threads, quota manager, Telegram connection pool
+and the poll scheduler are shared.
+"""
+
+import asyncio
+import heapq
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from telegram.request import HTTPXRequest
+from google_sheets_service import GoogleSheetsService
+from telegram_service import TelegramService
+from leads_monitor import LeadsMonitor
+from quota_manager import QuotaManager
+from config import (
+    TENANTS_FILE, TENANTS_DIR, TENANT_SHEETS_WORKERS, TENANT_INIT_CONCURRENCY, TELEGRAM_POOL_SIZE,
+    TELEGRAM_BOT_TOKEN, QUOTA_ENABLED, WRITEBACK_ENABLED, parse_user_ids
+)
+
+
+def load_tenant_specs(path):
+    """Read and validate TENANTS_FILE, returning name -> tenant dict with defaults filled in"""
+    with open(path) as tenants_file:
+        entries = json.load(tenants_file)
+    if not isinstance(entries, list):
+        raise ValueError("Tenants file must contain a JSON list")
+
+    specs = {}
+    for entry in entries:
+        name = entry.get('name', '')
+        if not re.fullmatch(r'[\w.-]+', name):
+            raise ValueError(f"Invalid tenant name {name!r}: use letters, digits, '.', '_' and '-'")
+        if name in specs:
+            raise ValueError(f"Duplicate tenant name {name!r}")
+        if not entry.get('sheet_id'):
+            raise ValueError(f"Tenant {name!r} has no sheet_id")
+
+        spec = dict(entry)
+        allowed_users = spec.get('allowed_users')
+        if isinstance(allowed_users, str):
+            spec['allowed_users'] = parse_user_ids(allowed_users)
+        elif allowed_users is not None:
+            spec['allowed_users'] = [int(user_id) for user_id in allowed_users]
+        spec.setdefault('state_file', os.path.join(TENANTS_DIR, name, 'monitor_state.json'))
+        spec.setdefault('snapshot_dir', os.path.join(TENANTS_DIR, name, 'snapshot'))
+        specs[name] = spec
+    return specs
+
+
+class TenantRegistry:
+    """Runs one LeadsMonitor per tenant on a shared event loop, executor and connection pools"""
+
+    def __init__(self, tenants_file=TENANTS_FILE, sheets_workers=TENANT_SHEETS_WORKERS,
+                 init_concurrency=TENANT_INIT_CONCURRENCY):
+        self.tenants_file = tenants_file
+        self.tenants = {}  # name -> LeadsMonitor
+        self._specs = {}  # name -> tenant dict the monitor was built from
+        self.quota = QuotaManager() if QUOTA_ENABLED else None
+        # Polls of every tenant queue up here in the order they became due, which is what
+        # keeps a burst of polls fair: no tenant has more than one poll in flight
+        self.sheets_executor = ThreadPoolExecutor(max_workers=sheets_workers, thread_name_prefix='sheets')
+        self.telegram_request = HTTPXRequest(connection_pool_size=TELEGRAM_POOL_SIZE)
+        self._sheets_services = {}  # Google refresh token (None = the bot's account) -> service
+        self._writeback_services = {}  # Same for the write-back clients
+        # Initial loads run on the shared sheets threads too; leave at least one to the polls
+        self._init_semaphore = asyncio.Semaphore(max(1, min(init_concurrency, sheets_workers - 1)))
+        self._initializing = set()
+        self._schedule = []  # heap of (due monotonic time, sequence, monitor)
+        self._sequence = 0
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._reload_requested = False
+        self._tenants_mtime = self._get_tenants_mtime()
+
+    def sheets_service_for(self, spec):
+        """Tenants on the same Google account share one client, breaker and connection set"""
+        refresh_token = spec.get('google_refresh_token')
+        if refresh_token not in self._sheets_services:
+            self._sheets_services[refresh_token] = GoogleSheetsService(quota=self.quota, refresh_token=refresh_token)
+        return self._sheets_services[refresh_token]
+
+    def writeback_service_for(self, spec):
+        if not spec.get('writeback', WRITEBACK_ENABLED):
+            return None
+        refresh_token = spec.get('google_write_refresh_token')
+        if refresh_token not in self._writeback_services:
+            self._writeback_services[refresh_token] = GoogleSheetsService.for_writes(refresh_token=refresh_token)
+        return self._writeback_services[refresh_token]
+    
+    def telegram_service_for(self, spec):
+        return TelegramService(
+            token=spec.get('telegram_bot_token', TELEGRAM_BOT_TOKEN),
+            allowed_users=spec.get('allowed_users'),
+            request=self.telegram_request,
+        )
+
+    def add_tenant(self, spec):
+        os.makedirs(os.path.dirname(spec['state_file']) or '.', exist_ok=True)
+        monitor = LeadsMonitor(
+            sheets_service=self.sheets_service_for(spec),
+            telegram_service=self.telegram_service_for(spec),
+            tenant=spec,
+            sheets_executor=self.sheets_executor,
+            writeback_service=self.writeback_service_for(spec),
+        )
+        self.tenants[spec['name']] = monitor
+        self._specs[spec['name']] = spec
+        return monitor
+
+    async def remove_tenant(self, name):
+        """Drain and checkpoint one tenant, then forget it"""
+        monitor = self.tenants.pop(name)
+        self._specs.pop(name)
+        await monitor.shutdown()
+
+    def _schedule_poll(self, monitor, delay):
+        self._sequence += 1
+        heapq.heappush(self._schedule, (time.monotonic() + delay, self._sequence, monitor))
+
+    def _start(self, monitors):
+        """Begin loading the tenants now and stagger their polls over one interval, so
+        hundreds of tenants don't poll at once"""
+        for index, monitor in enumerate(monitors):
+            self._begin_initialize(monitor)
+            self._schedule_poll(monitor, monitor.check_interval_minutes * 60 * index / len(monitors))
+
+    def _begin_initialize(self, monitor):
+        if monitor.name not in self._initializing:
+            self._initializing.add(monitor.name)
+            asyncio.create_task(self._initialize(monitor), name=f"tenant-init-{monitor.name}")
+
+    async def _initialize(self, monitor):
+        """Full sheet load for one tenant; only a few run at a time, they are the heaviest reads"""
+        try:
+            async with self._init_semaphore:
+                if self.tenants.get(monitor.name) is not monitor:
+                    return  # Removed by a reload while waiting
+                await monitor.initialize()
+                if self.tenants.get(monitor.name) is not monitor:
+                    return
+                if monitor.initialized:
+                    await monitor.start_pipeline()
+                    print(f"Tenant {monitor.name}: monitoring {monitor.sheet_id}/{monitor.sheet_tab}")
+                else:
+                    print(f"Tenant {monitor.name}: initialization failed, retrying next interval")
+        finally:
+            self._initializing.discard(monitor.name)
+
+    def _tick(self, monitor):
+        """One scheduled turn of a tenant: initialize it, or checkpoint and queue a poll"""
+        if not monitor.initialized:
+            self._begin_initialize(monitor)
+            return
+        monitor.checkpoint_if_idle()
+        if not monitor.pipeline.offer('poll'):
+            print(f"Tenant {monitor.name}: previous poll still waiting, skipping this one")
+
+    def request_reload(self):
+        """Ask the scheduler to re-read the tenants file before the next turn"""
+        self._reload_requested = True
+        self._wake.set()
+
+    def request_shutdown(self):
+        self._stopping = True
+        self._wake.set()
+
+    def _get_tenants_mtime(self):
+        try:
+            return os.path.getmtime(self.tenants_file)
+        except OSError:
+            return None
+
+    def _tenants_file_changed(self):
+        mtime = self._get_tenants_mtime()
+        if mtime == self._tenants_mtime:
+            return False
+        self._tenants_mtime = mtime
+        return True
+
+    async def reload(self):
+        """Start added tenants, stop removed ones and restart those whose settings changed"""
+        self._reload_requested = False
+        try:
+            specs = load_tenant_specs(self.tenants_file)
+        except Exception as e:
+            print(f"Error reloading tenants, keeping the current ones: {e}")
+            return
+
+        for name in [name for name in self.tenants if specs.get(name) != self._specs[name]]:
+            print(f"Tenant {name}: {'settings changed, restarting' if name in specs else 'removed'}")
+            await self.remove_tenant(name)
+        added = [self.add_tenant(spec) for name, spec in specs.items() if name not in self.tenants]
+        if added:
+            print(f"Starting {len(added)} tenant(s): {', '.join(monitor.name for monitor in added)}")
+            self._start(added)
+
+    async def run(self):
+        """Schedule every tenant's polls until shutdown is requested"""
+        specs = load_tenant_specs(self.tenants_file)
+        for spec in specs.values():
+            self.add_tenant(spec)
+        print(f"Loaded {len(self.tenants)} tenant(s) from {self.tenants_file}")
+        self._start(list(self.tenants.values()))
+
+        try:
+            while not self._stopping:
+                if self._reload_requested or self._tenants_file_changed():
+                    await self.reload()
+
+                now = time.monotonic()
+                while self._schedule and self._schedule[0][0] <= now:
+                    _, _, monitor = heapq.heappop(self._schedule)
+                    if self.tenants.get(monitor.name) is not monitor:
+                        continue  # Removed or restarted since it was scheduled
+                    try:
+                        self._tick(monitor)
+                    except Exception as e:
+                        print(f"Tenant {monitor.name}: error scheduling poll: {e}")
+                    self._schedule_poll(monitor, monitor.check_interval_minutes * 60)
+
+                # Sleep until the next tenant is due, waking early on reload or shutdown
+                # requests; the tenants file is checked at least once a minute
+                timeout = 60 if not self._schedule else min(60, max(0, self._schedule[0][0] - time.monotonic()))
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self):
+        """Drain and checkpoint every tenant at once, then release the shared pools"""
+        print(f"Shutting down {len(self.tenants)} tenant(s)...")
+        await asyncio.gather(*(monitor.shutdown() for monitor in self.tenants.values()), return_exceptions=True)
+        self.sheets_executor.shutdown(wait=False, cancel_futures=True)
+        await self.telegram_request.shutdown()
+
+    def stats(self):
+        """Per-tenant metrics plus the shared resources, for /metrics"""
+        stats = {
+            'tenants': {name: monitor.metrics() for name, monitor in self.tenants.items()},
+            'initializing': sorted(self._initializing),
+        }
+        if self.quota:
+            stats['quota'] = self.quota.usage()
+        return stats
@@ -0,0 +1,359 @@
+"""
+Record-and-replay of the Sheets and Telegram traffic, for reproducible performance runs.
+
+With TRACE_CAPTURE_FILE set every GoogleSheetsService and TelegramService records each
+request it executes, with its response or error and how long it took, as one compact JSON
+line:
+
+  {"t":12.503,"api":"sheets","call":"values.get","args":{...},"ms":183.2,"response":{...}}
+  {"t":13.101,"api":"telegram","call":"send_message","args":{...},"ms":95.0,"error":{...}}
+
+The monitor adds {"event": "initialized"} and {"event": "poll"} lines marking when its
+cycles ran. ReplaySheetsApi and ReplayBot serve a trace back in place of the real clients,
+see benchmarks/replay_trace.py. Traces hold the full lead data of the sheet, so they are
+created readable by the owner only and kept out of git (traces/).
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+import httplib2
+from googleapiclient.errors import HttpError
+from telegram import error as telegram_errors
+from config import TRACE_CAPTURE_FILE
+
+TRACE_VERSION = 1
+RECORDED_BOT_METHODS = ('send_message', 'get_me', 'get_updates')
+
+
+def trace_key(api, call, args):
+    """
+    What a replayed request is matched on. Message texts and written values contain the time
+    they were made, so they are left out; recorded responses are served in order per key.
+    """
+    if api == 'sheets':
+        return (call, args.get('spreadsheetId'), args.get('range'), args.get('majorDimension'),
+                args.get('valueRenderOption'))
+    return (call, args.get('chat_id'))
+
+
+def _jsonable(result):
+    """Telegram objects (and tuples of them) as plain JSON values"""
+    if isinstance(result, (tuple, list)):
+        return [_jsonable(item) for item in result]
+    if hasattr(result, 'to_dict'):
+        return result.to_dict()
+    return result
+
+
+def _describe_error(error):
+    described = {'type': type(error).__name__, 'message': str(error)}
+    if isinstance(error, HttpError):
+        described['status'] = error.resp.status
+        if error.resp.get('retry-after'):
+            described['retry_after'] = error.resp.get('retry-after')
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None and not isinstance(error, HttpError):
+        described['retry_after'] = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else retry_after
+    return described
+
+
+class TraceRecorder:
+    """Appends trace lines to a file; safe to use from the event loop and worker threads"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # The trace holds every lead's personal data: only the owner may read it
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self._file = os.fdopen(descriptor, 'a', buffering=1)
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._write({'trace_version': TRACE_VERSION, 'started_at': time.time()})
+        print(f"Recording Sheets and Telegram traffic to {path}")
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def _elapsed(self):
+        return round(time.monotonic() - self._started, 3)
+
+    def record(self, api, call, args, started, response=None, error=None):
+        record = {
+            't': round(started - self._started, 3),
+            'api': api,
+            'call': call,
+            'args': args,
+            'ms': round((time.monotonic() - started) * 1000, 1),
+        }
+        if error is not None:
+            record['error'] = _describe_error(error)
+        else:
+            record['response'] = response
+        self._write(record)
+
+    def event(self, event, **fields):
+        self._write(dict(fields, t=self._elapsed(), event=event))
+
+    def wrap_sheets(self, service):
+        return RecordingSheetsApi(service, self)
+
+    def wrap_bot(self, bot):
+        return RecordingBot(bot, self)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """The process's TraceRecorder when TRACE_CAPTURE_FILE is set, otherwise None"""
+    global _recorder
+    if _recorder is None and TRACE_CAPTURE_FILE:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = TraceRecorder(TRACE_CAPTURE_FILE)
+    return _recorder
+
+
+def trace_event(event, **fields):
+    """Mark a point in the trace (e.g. the start of a poll); does nothing when not capturing"""
+    recorder = get_recorder()
+    if recorder:
+        recorder.event(event, **fields)
+
+
+class RecordedRequest:
+    """A Sheets request that records itself when executed"""
+
+    def __init__(self, recorder, call, args, request):
+        self.recorder = recorder
+        self.call = call
+        self.args = args
+        self.request = request
+
+    def execute(self, **kwargs):
+        started = time.monotonic()
+        try:
+            response = self.request.execute(**kwargs)
+        except Exception as e:
+            self.recorder.record('sheets', self.call, self.args, started, error=e)
+            raise
+        self.recorder.record('sheets', self.call, self.args, started, response=response)
+        return response
+
+
+class RecordingSheetsApi:
+    """Stands in for `service.spreadsheets().values()` and records every executed request"""
+
+    def __init__(self, service, recorder):
+        self.service = service
+        self.recorder = recorder
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, **kwargs):
+        return RecordedRequest(self.recorder, 'values.get', kwargs, self.service.spreadsheets().values().get(**kwargs))
+
+    def batchUpdate(self, **kwargs):
+        return RecordedRequest(
+            self.recorder, 'values.batchUpdate', kwargs, self.service.spreadsheets().values().batchUpdate(**kwargs)
+        )
+
+
+class RecordingBot:
+    """Wraps a telegram.Bot, recording the calls the services make"""
+
+    def __init__(self, bot, recorder):
+        self._bot = bot
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attribute = getattr(self._bot, name)
+        if name not in RECORDED_BOT_METHODS:
+            return attribute
+
+        async def recorded(**kwargs):
+            started = time.monotonic()
+            try:
+                result = await attribute(**kwargs)
+            except Exception as e:
+                self._recorder.record('telegram', name, kwargs, started, error=e)
+                raise
+            self._recorder.record('telegram', name, kwargs, started, response=_jsonable(result))
+            return result
+        return recorded
+
+
+class ReplayMiss(Exception):
+    """The code under replay made a request the trace has no (more) responses for"""
+
+
+class Trace:
+    """A recorded trace, with its responses queued per trace_key() for replay"""
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self.calls = []
+        with open(path) as trace_file:
+            for line in trace_file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if 'trace_version' in record:
+                    if record['trace_version'] != TRACE_VERSION:
+                        raise ValueError(f"Unsupported trace version {record['trace_version']} in {path}")
+                elif 'event' in record:
+                    self.events.append(record)
+                else:
+                    self.calls.append(record)
+        self._queues = defaultdict(deque)
+        for record in self.calls:
+            self._queues[(record['api'],) + trace_key(record['api'], record['call'], record['args'])].append(record)
+        self.misses = defaultdict(int)
+
+    def next_response(self, api, call, args):
+        """The next recorded record for this request, raising ReplayMiss if there is none"""
+        key = (api,) + trace_key(api, call, args)
+        try:
+            return self._queues[key].popleft()
+        except IndexError:
+            self.misses[' '.join(str(part) for part in key)] += 1
+            raise ReplayMiss(f"No recorded response for {api} {call} {args.get('range') or args.get('chat_id')}")
+
+    def unused(self):
+        """Number of recorded requests the replay never made, per api and call"""
+        unused = defaultdict(int)
+        for (api, call, *_), queue in self._queues.items():
+            if queue:
+                unused[f'{api} {call}'] += len(queue)
+        return dict(unused)
+
+    def skip_until(self, seconds):
+        """Drop responses recorded before this trace time, e.g. those of the initial load"""
+        for queue in self._queues.values():
+            while queue and queue[0]['t'] < seconds:
+                queue.popleft()
+
+
+class ReplayTimings:
+    """Durations of the replayed calls as the services saw them, per call"""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+
+    def add(self, api, call, seconds):
+        self.durations[f'{api} {call}'].append(seconds)
+
+    def summary(self):
+        summary = {}
+        for name, durations in sorted(self.durations.items()):
+            durations = sorted(durations)
+            summary[name] = {
+                'calls': len(durations),
+                'mean_ms': round(sum(durations) / len(durations) * 1000, 1),
+                'p95_ms': round(durations[int(0.95 * (len(durations) - 1))] * 1000, 1),
+            }
+        return summary
+
+
+class ReplayRequest:
+    def __init__(self, api, call, args):
+        self.api = api
+        self.call = call
+        self.args = args
+
+    def execute(self, **_kwargs):
+        started = time.monotonic()
+        record = self.api.trace.next_response('sheets', self.call, self.args)
+        if self.api.speed:
+            time.sleep(record['ms'] / 1000 / self.api.speed)
+        self.api.timings.add('sheets', self.call, time.monotonic() - started)
+        if 'error' in record:
+            raise _sheets_error(record['error'])
+        return record['response']
+
+
+def _sheets_error(described):
+    if 'status' in described:
+        headers = {'status': str(described['status'])}
+        if 'retry_after' in described:
+            headers['retry-after'] = str(described['retry_after'])
+        return HttpError(httplib2.Response(headers), described['message'].encode('utf-8'))
+    return ConnectionError(described['message'])
+
+
+class ReplaySheetsApi:
+    """Serves a trace's Sheets responses in place of `service.spreadsheets().values()`"""
+
+    def __init__(self, trace, speed=1.0, timings=None):
+        self.trace = trace
+        self.speed = speed  # 0 replays without the recorded latency
+        self.timings = timings or ReplayTimings()
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, **kwargs):
+        return ReplayRequest(self, 'values.get', kwargs)
+
+    def batchUpdate(self, **kwargs):
+        return ReplayRequest(self, 'values.batchUpdate', kwargs)
+
+
+def _telegram_error(described):
+    error_class = getattr(telegram_errors, described['type'], None)
+    if error_class is telegram_errors.RetryAfter:
+        return error_class(int(described.get('retry_after', 1)))
+    if error_class is telegram_errors.ChatMigrated:
+        return telegram_errors.BadRequest(described['message'])
+    if isinstance(error_class, type) and issubclass(error_class, telegram_errors.TelegramError):
+        return error_class(described['message'])
+    return telegram_errors.NetworkError(described['message'])
+
+
+class ReplayBot:
+    """Serves a trace's Telegram responses in place of a telegram.Bot"""
+
+    def __init__(self, trace, speed=1.0, timings=None):
+        self.trace = trace
+        self.speed = speed
+        self.timings = timings or ReplayTimings()
+
+    async def _replay(self, call, args):
+        started = time.monotonic()
+        record = self.trace.next_response('telegram', call, args)
+        if self.speed:
+            await asyncio.sleep(record['ms'] / 1000 / self.speed)
+        self.timings.add('telegram', call, time.monotonic() - started)
+        if 'error' in record:
+            raise _telegram_error(record['error'])
+        return record['response']
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._replay('send_message', dict(kwargs, chat_id=chat_id, text=text))
+
+    async def get_me(self, **kwargs):
+        return await self._replay('get_me', kwargs)
+
+    async def get_updates(self, **kwargs):
+        # Bot commands aren't part of a replay
+        await asyncio.sleep(kwargs.get('timeout') or 0)
+        return ()